@@ -0,0 +1,186 @@
+"""
+Benchmarks fitting, sampling and rendering of splines for different numbers of points and degrees.
+
+Every phase is timed separately (the best of a few repeats), the peak memory of fitting is measured with
+tracemalloc, and the results are written to a JSON file. If a baseline file from an earlier run is given,
+phases that got slower by more than the threshold are reported and the exit code is 1. Example:
+
+    python3 benchmark.py --output before.json
+    python3 benchmark.py --baseline before.json --output after.json
+"""
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+from spline_functions import (spline_system, natural_spline_matrix, natural_spline_rhs, thomas_factor, thomas_solve,
+                              spline_blocks, spline_rhs, BlockBandedSolver, adaptive_samples)
+from point_store import PointStore
+
+DEFAULT_sizes = [10, 100, 1000, 10000, 100000]
+DEFAULT_degrees = range(3, 14, 2)     # the same degrees as on the slider in the GUI
+DEFAULT_repeat = 3
+DEFAULT_threshold = 0.25        # a phase is a regression if it is more than 25 % slower than the baseline
+MIN_duration = 1e-3             # phases faster than this many seconds are too noisy to be compared
+NUM_evaluations = 10**5         # number of points in the 'evaluate' phase
+FIGURE_size = (8, 6)            # size of the rendered figure in inches, at 100 dpi
+PHASES = ["assemble", "solve", "evaluate", "sample", "render", "store"]
+
+
+def make_points(n, seed=0):
+    """Returns n+1 points with random distinct x coordinates in [-1, 1] and y values of a noisy sine."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-1, 1, n+1) + rng.uniform(-0.25, 0.25, n+1) / n
+    y = np.sin(3*x) + 0.1*rng.standard_normal(n+1)
+    return x, y
+
+
+def best_time(func, repeat):
+    """Returns the shortest time of 'repeat' calls of 'func' and the result of the last call."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def assemble(x, y, m):
+    """
+    Creates the SoLE of the spline of degree m on the points (x, y) without factorizing it, as the systems
+    returned by 'spline_system' do.
+    """
+    if m == 3:
+        return natural_spline_matrix(x), natural_spline_rhs(x, y)
+    return spline_blocks(x, m), spline_rhs(y, m)
+
+
+def solve(matrix, b, m):
+    """Factorizes and solves the SoLE created by 'assemble'."""
+    if m == 3:
+        return thomas_solve(thomas_factor(*matrix), b)
+    return BlockBandedSolver(*matrix).solve(b)
+
+
+def render(f, x, repeat):
+    """Times sampling the spline 'f' as in the GUI and drawing it with the Agg backend. Returns (sample, render)."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=FIGURE_size, dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.set_xlim(x[0], x[-1])
+    ax.set_ylim(-2, 2)
+    height = ax.bbox.height
+    sample, t = best_time(lambda: adaptive_samples(f, x[0], x[-1], height / 4, 0.25, 2**18), repeat)
+    ax.plot(t, f(t))
+    canvas.draw()   # the first draw creates the ticks, labels...
+    draw, _ = best_time(canvas.draw, repeat)
+    return sample, draw
+
+
+def fill_store(x, y):
+    store = PointStore()
+    for i in np.random.default_rng(0).permutation(len(x)):     # the points are added in a random order
+        store.insert(x[i], y[i])
+    return store.min_gap
+
+
+def peak_memory(x, y, m):
+    """Returns the peak memory in bytes allocated while fitting the spline of degree m to the points (x, y)."""
+    tracemalloc.start()
+    spline_system(x, m).fit(y)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def run(n, m, repeat, render_curve):
+    """Runs all phases for n+1 points and degree m and returns the results as a dict."""
+    x, y = make_points(n)
+    result = {"n": n, "degree": m}
+    result["assemble"], (matrix, b) = best_time(lambda: assemble(x, y, m), repeat)
+    result["solve"], v = best_time(lambda: solve(matrix, b, m), repeat)
+    f = spline_system(x, m).spline(x, y, v)
+    t = np.linspace(x[0], x[-1], NUM_evaluations)
+    result["evaluate"], _ = best_time(lambda: f(t), repeat)
+    if render_curve:
+        result["sample"], result["render"] = render(f, x, repeat)
+    result["store"], _ = best_time(lambda: fill_store(x, y), repeat)
+    result["peak_bytes"] = peak_memory(x, y, m)
+    return result
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the phases of 'results' that are more than 'threshold' slower than in 'baseline' as strings.
+    Phases that took less than MIN_duration are skipped.
+    """
+    old = {(r["n"], r["degree"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = old.get((r["n"], r["degree"]))
+        if b is None:
+            continue
+        for phase in PHASES + ["peak_bytes"]:
+            if r.get(phase) is None or not b.get(phase):
+                continue
+            if phase != "peak_bytes" and r[phase] < MIN_duration:
+                continue
+            ratio = r[phase] / b[phase]
+            if ratio > 1 + threshold:
+                regressions.append(f"n={r['n']} degree={r['degree']} {phase}: {b[phase]:.4g} -> {r[phase]:.4g} "
+                                   f"({ratio:.2f}x)")
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark fitting, sampling and rendering of splines.")
+    parser.add_argument("-n", "--sizes", type=int, nargs="+", default=DEFAULT_sizes, help="numbers of points")
+    parser.add_argument("-d", "--degrees", type=int, nargs="+", default=list(DEFAULT_degrees),
+                        help="degrees of the splines")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_repeat,
+                        help="every phase is run this many times and the best time is kept")
+    parser.add_argument("--no-render", action="store_true", help="skip rendering (matplotlib is not needed then)")
+    parser.add_argument("-o", "--output", help="JSON file for the results")
+    parser.add_argument("-b", "--baseline", help="JSON file with the results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_threshold,
+                        help="relative slowdown reported as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    print(f"{'n':>7} {'degree':>6} " + " ".join(f"{p:>9}" for p in PHASES) + f" {'peak MiB':>9}")
+    for n in args.sizes:
+        for m in args.degrees:
+            try:
+                r = run(n, m, args.repeat, not args.no_render)
+            except np.linalg.LinAlgError as e:  # high degrees on many points may be too badly conditioned
+                r = {"n": n, "degree": m, "error": str(e)}
+            results.append(r)
+            times = " ".join(f"{r[p]*1e3:>7.2f}ms" if r.get(p) is not None else f"{'-':>9}" for p in PHASES)
+            peak = f"{r['peak_bytes'] / 2**20:>9.2f}" if "peak_bytes" in r else f"{'-':>9}"
+            print(f"{n:>7} {m:>6} {times} {peak}", flush=True)
+
+    if args.output is not None:
+        meta = {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+                "platform": platform.platform(), "repeat": args.repeat}
+        with open(args.output, "w") as file:
+            json.dump({"meta": meta, "results": results}, file, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for line in regressions:
+            print("regression:", line)
+        if regressions:
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import numpy as np
+from math import floor, ceil, log2
+from collections import OrderedDict
+from spline_functions import adaptive_samples
+
+TILE_pixels = 256               # tiles are between TILE_pixels/2 and TILE_pixels wide on the screen
+MAX_tile_samples = 64 * TILE_pixels     # sampling cap of one tile before it is decimated
+DEFAULT_tile_bytes = 2**26      # memory budget of 'CurveTiles' (64 MiB)
+
+
+class CurveTiles:
+    """
+    Multi-resolution cache of the samples of the spline 'f' for drawing.
+
+    The x axis is split into tiles of width $2^e$ where e (the zoom level) is chosen so that a tile is between
+    TILE_pixels/2 and TILE_pixels wide on the screen. Every tile is sampled by 'adaptive_samples' for the
+    pixels per unit of y rounded up to a power of two, so the same tile serves all nearby zooms. Tiles with more
+    samples than two per pixel column (many knots on few pixels) are reduced to the minimum and maximum of every
+    column, which draws the same. Panning and zooming back only evaluate the newly exposed tiles; the least
+    recently used tiles are evicted when they take more than 'max_bytes'.
+    """
+    def __init__(self, f, max_bytes=DEFAULT_tile_bytes, dtype=float):
+        self.f = f
+        self.evaluate = f.astype(dtype) if dtype != float else f
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.tiles = OrderedDict()      # (e, ylevel, k, tol) -> (t, s), the least recently used first
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def samples(self, xmin, xmax, xscale, yscale, tol=0.5):
+        """
+        Returns the samples (t, s) of the curve for drawing it in [xmin, xmax] with 'xscale' and 'yscale' pixels
+        per unit of x and y, at most 'tol' pixels away from the curve. The samples cover whole tiles,
+        so they can extend past [xmin, xmax].
+        """
+        x = self.f.x
+        xmin, xmax = max(xmin, x[0]), min(xmax, x[-1])
+        if xmin >= xmax:
+            return np.array([]), np.array([])
+        e = floor(log2(TILE_pixels / xscale))
+        ylevel = ceil(log2(yscale))
+        width = 2.0**e
+        parts = [self.tile(e, ylevel, k, tol) for k in range(floor(xmin / width), floor(xmax / width) + 1)]
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def tile(self, e, ylevel, k, tol):
+        """Returns the samples (t, s) of the k-th tile of the zoom level e, computes them if they are not cached."""
+        key = (e, ylevel, k, tol)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        width = 2.0**e
+        lo, hi = k * width, (k+1) * width
+        t = adaptive_samples(self.f, lo, hi, 2.0**ylevel, tol, MAX_tile_samples)
+        s = self.evaluate(t)
+        if len(t) > 2 * TILE_pixels:
+            t, s = decimate(t, s, lo, hi, TILE_pixels)
+        self.tiles[key] = (t, s)
+        self.nbytes += t.nbytes + s.nbytes
+        while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+            t_old, s_old = self.tiles.popitem(last=False)[1]
+            self.nbytes -= t_old.nbytes + s_old.nbytes
+        return t, s
+
+
+def decimate(t, s, lo, hi, bins):
+    """
+    Keeps only the samples with the minimal and maximal value in every one of 'bins' equal parts of [lo, hi].
+    't' must be sorted, the order of the samples is kept.
+    """
+    b = np.clip(((t - lo) * (bins / (hi - lo))).astype(int), 0, bins-1)
+    order = np.lexsort((s, b))      # by bins, then by values
+    first = np.flatnonzero(np.diff(b[order], prepend=-1))   # the first sample of every bin in 'order'
+    last = np.append(first[1:] - 1, len(order) - 1)
+    keep = np.unique(np.concatenate([order[first], order[last]]))
+    return t[keep], s[keep]
@@ -0,0 +1,147 @@
+"""
+Generates load on spline_server.py and reports the throughput and the latency percentiles.
+
+Every client keeps one connection open and sends its requests one after another. The fitted series share
+--knot-sets different x vectors, so the server can solve the fits on the same knots in batches. Example:
+
+    python3 spline_server.py &
+    python3 load_generator.py --clients 32 --requests 200 --points 1000 --degree 5 --samples 1000
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+from spline_server import DEFAULT_host, DEFAULT_port, DEGREES
+
+DEFAULT_clients = 16
+DEFAULT_requests = 100      # per client
+DEFAULT_points = 100
+PERCENTILES = [50, 90, 99]
+
+
+class Client:
+    """Sends requests to the server over one keep-alive connection."""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, args):
+        if args.unix is not None:
+            return cls(*await asyncio.open_unix_connection(args.unix))
+        return cls(*await asyncio.open_connection(args.host, args.port))
+
+    async def request(self, method, path, obj=None):
+        """Sends the request and returns (status, body). Chunked bodies are joined."""
+        body = b"" if obj is None else json.dumps(obj).encode()
+        self.writer.write(b"%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                          b"Content-Length: %d\r\n\r\n%s" % (method.encode(), path.encode(), len(body), body))
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding") != "chunked":
+            return status, await self.reader.readexactly(int(headers.get("content-length", 0)))
+        chunks = []
+        while True:
+            size = int(await self.reader.readline(), 16)
+            chunks.append(await self.reader.readexactly(size + 2))   # with the trailing CRLF
+            if size == 0:
+                return status, b"".join(c[:-2] for c in chunks)
+
+    def close(self):
+        self.writer.close()
+
+
+def make_knot_sets(args, rng):
+    """Returns --knot-sets increasing x vectors of --points points."""
+    return [np.cumsum(rng.uniform(0.5, 1.5, args.points)) for _ in range(args.knot_sets)]
+
+
+async def run_client(args, knot_sets, seed, latencies, errors):
+    rng = np.random.default_rng(seed)
+    client = await Client.connect(args)
+    try:
+        for _ in range(args.requests):
+            x = knot_sets[rng.integers(len(knot_sets))]
+            request = {"x": x.tolist(), "y": rng.standard_normal(len(x)).tolist(), "degree": args.degree}
+            if args.samples:
+                request["samples"] = args.samples
+            start = time.perf_counter()
+            status, body = await client.request("POST", "/fit", request)
+            latencies.append(time.perf_counter() - start)
+            if status != 200 or (args.samples and len(body) != 8 * args.samples):
+                errors.append(f"{status}: {body[:200]!r}")
+    finally:
+        client.close()
+
+
+async def server_stats(args):
+    client = await Client.connect(args)
+    try:
+        return json.loads((await client.request("GET", "/stats"))[1])
+    finally:
+        client.close()
+
+
+async def generate(args):
+    """Runs the clients and returns their latencies, errors, the time taken and the server counters of the run."""
+    knot_sets = make_knot_sets(args, np.random.default_rng(0))
+    latencies, errors = [], []
+    before = await server_stats(args)
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(args, knot_sets, seed, latencies, errors) for seed in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    after = await server_stats(args)
+    stats = {name: after[name] - before.get(name, 0) for name in after}    # only this run, not the server lifetime
+    return latencies, errors, elapsed, stats
+
+
+def report(latencies, errors, elapsed, stats):
+    ms = np.array(latencies) * 1e3
+    print(f"{len(ms)} requests in {elapsed:.2f} s: {len(ms) / elapsed:.1f} requests/s, {len(errors)} errors")
+    print("latency ms: " + "  ".join(f"p{p} {np.percentile(ms, p):.2f}" for p in PERCENTILES)
+          + f"  max {ms.max():.2f}  mean {ms.mean():.2f}")
+    if stats["batches"]:
+        print(f"server: {stats['batched_fits']} fits in {stats['batches']} batches "
+              f"({stats['batched_fits'] / stats['batches']:.1f} per batch), "
+              f"cache {stats['cache_hits']} hits / {stats['cache_misses']} misses")
+    for error in errors[:5]:
+        print("error:", error)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate load on spline_server.py and report latencies.")
+    parser.add_argument("--host", default=DEFAULT_host)
+    parser.add_argument("--port", type=int, default=DEFAULT_port)
+    parser.add_argument("--unix", help="connect to the server on this Unix socket")
+    parser.add_argument("-c", "--clients", type=int, default=DEFAULT_clients, help="number of concurrent clients")
+    parser.add_argument("-r", "--requests", type=int, default=DEFAULT_requests, help="number of requests per client")
+    parser.add_argument("-n", "--points", type=int, default=DEFAULT_points, help="number of points of a fit")
+    parser.add_argument("-k", "--knot-sets", type=int, default=4, help="number of distinct x vectors")
+    parser.add_argument("-d", "--degree", type=int, default=3, choices=DEGREES, help="degree of the splines")
+    parser.add_argument("-s", "--samples", type=int, default=0,
+                        help="number of values evaluated and streamed back per fit, 0 to only fit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        latencies, errors, elapsed, stats = asyncio.run(generate(args))
+    except OSError as e:
+        sys.exit(f"can't connect to the server: {e}")
+    report(latencies, errors, elapsed, stats)
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
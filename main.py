@@ -1,9 +1,19 @@
-from spline_functions import binary_search, min_interval, update_coords_add, update_coords_del, spline
+from spline_functions import adaptive_samples, chord_parameters, DragSession, SplineCache
+from point_store import PointStore, PathStore
+from curve_tiles import CurveTiles
+from spline_file import save_session, load_session, EXTENSION
+import profiling
+import os
 import sys
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
 from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
@@ -16,7 +26,9 @@ from PyQt5.QtWidgets import (
     QLineEdit,
     QCheckBox,
     QRadioButton,
-    QMessageBox
+    QMessageBox,
+    QFileDialog,
+    QComboBox
 )
 
 # constants
@@ -25,9 +37,16 @@ DEFAULT_xmax = 10
 DEFAULT_ymin = -10
 DEFAULT_ymax = 10
 
-MIN_freq = 100
 MAX_len_linspace = 2**18        # max size for float64 will be 2**21B = 2MB
-MIN_INTERVAL_num_points = 100
+MAX_pixel_error = 0.25          # max distance of the drawn polyline from the spline curve in pixels
+PICK_radius = 5                 # max distance of a click from the picked point in points (1/72 inch)
+PAN_margin = 1                  # while moving the canvas, the curve is sampled this many widths of the view around it
+
+PREFETCH_max_points = 1000      # the neighbouring degrees are solved in advance only for fewer points
+WORKER_threads = min(4, os.cpu_count() or 1)    # number of curves fitted at the same time
+
+CURVE_colors = ["C0", "C1", "C2", "C4", "C5", "C6", "C8", "C9"]    # C3 is red like the points of the active curve
+ACTIVE_color = "r"              # color of the points of the active curve
 
 MIN_deg = 3
 DEFAULT_deg = 3
@@ -38,110 +57,377 @@ ZOOM = 2
 MAX_zoom = 5e-3
 
 
+class SplineRequest:
+    """State needed to calculate and sample a spline function in the background, see 'SplineWorker'."""
+    def __init__(self, curve, xs, ys, degree, xrange, xscale, yscale, auto_adjust, polynomials=None, drag=None,
+                 parametric=False):
+        self.id = None                  # set by SplineWorker.submit
+        self.curve = curve              # the Curve the spline is calculated for
+        self.xs = xs                    # coords of the points
+        self.ys = ys
+        self.degree = degree
+        self.xrange = xrange            # the spline is sampled on xrange
+        self.xscale = xscale            # pixels per unit of x
+        self.yscale = yscale            # pixels per unit of y
+        self.auto_adjust = auto_adjust  # True if the lims should be fitted to the curve once it is drawn
+        self.polynomials = polynomials  # if given, they are only sampled
+        self.drag = drag                # if given, the DragSession is used to calculate the polynomials
+        self.parametric = parametric    # True for the parametric curve (x(t), y(t)) through the points in order
+        self.knots = None               # knots and values of the spline, set by the worker
+        self.values = None
+        self.submitted = time.perf_counter()
+
+
+class SplineWorker(QObject):
+    """
+    Calculates and samples spline functions on a pool of threads, so that the GUI stays responsive and several
+    curves are fitted in parallel (numpy releases the GIL in the solvers and in the evaluation).
+
+    The requests of every curve are computed one by one, the requests of different curves at the same time.
+    Only the newest request of a curve is kept while it is busy, so queued requests don't pile up and only the
+    newest state is drawn; editing one curve never waits for nor recomputes the others.
+
+    The splines and factorizations are kept in a 'SplineCache' shared by the threads, so changing only the view
+    or going back to a previous degree doesn't solve the SoLE again. When a curve has no newer request,
+    its neighbouring degrees on the slider are solved in advance.
+    """
+    done = pyqtSignal(object)           # emitted by a pool thread with (request, polynomials, t, s)
+
+    def __init__(self, threads=WORKER_threads):
+        super().__init__()
+        self.count = 0                  # id of the last submitted request
+        self.latest = {}                # curve -> id of its newest request, only the curves which aren't removed
+        self.pending = {}               # curve -> its newest request which hasn't started yet
+        self.running = set()            # curves which have a request being computed
+        self.lock = threading.Lock()
+        self.cache = SplineCache()
+        self.tiles = {}                 # curve -> CurveTiles of its last spline
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix="spline")
+
+    def submit(self, request):
+        with self.lock:
+            self.count += 1
+            request.id = self.count
+            self.latest[request.curve] = request.id
+            self.pending[request.curve] = request
+            if request.curve in self.running:   # picked up when the running request is done
+                return
+            self.running.add(request.curve)
+        self.pool.submit(self.run, request.curve)
+
+    def cancel(self, curve):
+        """Drops the submitted requests of 'curve'."""
+        with self.lock:
+            self.count += 1
+            self.latest[curve] = self.count
+            self.pending.pop(curve, None)
+
+    def remove(self, curve):
+        """Drops the requests and the cached tiles of a deleted curve."""
+        with self.lock:
+            self.latest.pop(curve, None)    # its running request is superseded and doesn't cache tiles anymore
+            self.pending.pop(curve, None)
+            self.tiles.pop(curve, None)
+
+    def is_latest(self, request):
+        return self.latest.get(request.curve) == request.id
+
+    def stop(self):
+        with self.lock:
+            self.pending.clear()
+        self.pool.shutdown(wait=True)
+
+    def run(self, curve):
+        """Computes the requests of 'curve' in a pool thread until it has no pending one."""
+        while True:
+            with self.lock:
+                request = self.pending.pop(curve, None)
+                if request is None:
+                    self.running.discard(curve)
+                    return
+            try:
+                self.compute(request)
+                if request.drag is None and request.polynomials is None and len(request.xs) <= PREFETCH_max_points:
+                    self.solve_neighbours(request)
+            except Exception:   # the thread must go on with the next request
+                sys.excepthook(*sys.exc_info())
+
+    def compute(self, request):
+        if not self.is_latest(request):     # superseded
+            return
+        if request.parametric:  # x(t) and y(t) are solved together as two right-hand sides
+            request.knots = chord_parameters(request.xs, request.ys)
+            request.values = np.vstack([request.xs, request.ys])
+        else:
+            request.knots, request.values = request.xs, request.ys
+        if request.drag is not None:
+            j = request.drag.j
+            polynomials = request.drag.move(request.xs[j], request.ys[j])
+        elif request.polynomials is not None:
+            polynomials = request.polynomials
+        else:
+            polynomials = self.cache.spline(request.knots, request.values, request.degree)
+        if request.parametric:  # the whole curve is sampled, t doesn't correspond to the x axis
+            with profiling.span("sample"):
+                t = adaptive_samples(polynomials, polynomials.x[0], polynomials.x[-1], (request.xscale, request.yscale),
+                                     MAX_pixel_error, MAX_len_linspace)
+            with profiling.span("evaluate"):
+                t, s = polynomials.astype(np.float32)(t)
+        elif request.drag is None:  # the same spline is drawn again and again while zooming and moving the canvas
+            tiles = self.tiles.get(request.curve)
+            if tiles is None or tiles.f is not polynomials:
+                tiles = CurveTiles(polynomials, dtype=np.float32)
+                with self.lock:
+                    if request.curve in self.latest:    # not removed meanwhile
+                        self.tiles[request.curve] = tiles
+            with profiling.span("sample"):
+                t, s = tiles.samples(*request.xrange, request.xscale, request.yscale, MAX_pixel_error)
+        else:
+            with profiling.span("sample"):
+                t = adaptive_samples(polynomials, *request.xrange, request.yscale, MAX_pixel_error, MAX_len_linspace)
+            with profiling.span("evaluate"):
+                s = polynomials.astype(np.float32)(t)  # float32 is precise enough for drawing and faster
+        profiling.count("samples", len(t))
+        if self.is_latest(request):
+            self.done.emit((request, polynomials, t, s))    # queued to the GUI thread
+
+    def solve_neighbours(self, request):
+        """Solves the spline for the neighbouring degrees of 'request' unless a newer request has been submitted."""
+        for degree in (request.degree + 2, request.degree - 2):
+            if not self.is_latest(request):
+                return
+            if MIN_deg <= degree <= MAX_deg:
+                self.cache.spline(request.knots, request.values, degree)
+
+
+class Curve:
+    """Points, degree and drawn spline of one of the curves on the canvas."""
+    def __init__(self, axes, color, degree=DEFAULT_deg):
+        self.color = color
+        self.store = PathStore() if MyApp.parametric else PointStore()  # the points of the curve
+        self.degree = degree
+        self.points, = axes.plot([], [], marker="o", linestyle="None", color=color, animated=True)
+        self.curve, = axes.plot([], [], c=color, animated=True)     # Line2D of the spline curve
+        self.polynomials = None         # spline function (PiecewisePolynomial) will be stored here
+        self.fitted = None              # SplineRequest the polynomials were calculated for
+        self.sampled = None             # (xmin, xmax) covered by the drawn curve
+
+    def current_polynomials(self):
+        """Returns the drawn spline if it was calculated for the current points, degree and mode, else None."""
+        r = self.fitted
+        if (self.polynomials is None or r is None or r.degree != self.degree or r.parametric != MyApp.parametric
+                or not np.array_equal(r.xs, self.store.xs) or not np.array_equal(r.ys, self.store.ys)):
+            return None
+        return self.polynomials
+
+    def remove(self):
+        self.points.remove()
+        self.curve.remove()
+
+
 class SplineCurvesBuilder:
-    """Plots spline curves using the matplotlib library."""
-    def __init__(self, points, app):
+    """
+    Plots spline curves using the matplotlib library.
+
+    The canvas holds several independent curves, each with its own points and degree. The points are added,
+    deleted and moved on the active curve; only the curves which have changed are fitted and sampled again,
+    changes of the view resample all of them.
+    """
+    def __init__(self, axes, app):
         self.press = None               # holds x, y of pressed point while moving, else None
         self.moving_canvas = False      # True if moving canvas, else False
         self.moving_point = False       # True if moving a point on canvas, else False
-        self.points = points            # 'points' given to the constructor will be a Line2D ax.plot([0], [0]) object
-                                        # we need it to access points.figure.canvas
-        self.polynomials = None         # spline functions will be stored here
+        self.axes = axes
+        self.background = None          # copy of the axes without the curves and the points for blitting
+        self.background_lims = None     # xlim, ylim of the axes when the background was copied
         self.app = app                  # the MyApp object SCB is embedded in
-        self.xs = []                    # x coordinates of the points
-        self.ys = []                    # y coordinates of the points
-        self.degree = DEFAULT_deg       # degree of the spline function
+        self.curves = []                # all Curves on the canvas
+        self.active = None              # the Curve which is edited
+        self.moving = None              # index of the moving point in the store of the active curve
+        self.drag = None                # DragSession of the moving point, else None
+        self.worker = SplineWorker()    # calculates the spline functions in the background
+        self.worker.done.connect(self.draw_curve, Qt.QueuedConnection)
+        self.frames = deque()           # times when the last curves were drawn, for the overlay
+        self.overlay = None             # Text with the FPS and timings if MyApp.show_overlay is True
+        if MyApp.show_overlay:
+            self.overlay = axes.text(0.01, 0.99, "", transform=axes.transAxes, va="top",
+                                     family="monospace", fontsize=9, animated=True)
+        self.add_curve()
+        # the points are hit-tested by the stores ('hit_test'), so matplotlib doesn't have to pick them
+
+    def add_curve(self, degree=DEFAULT_deg):
+        """Adds a new empty curve and makes it active."""
+        color = CURVE_colors[len(self.curves) % len(CURVE_colors)]
+        self.curves.append(Curve(self.axes, color, degree))
+        self.select(len(self.curves) - 1)
+        return self.curves[-1]
+
+    def remove_curves(self):
+        """Removes all curves."""
+        for curve in self.curves:
+            self.worker.remove(curve)
+            curve.remove()
+        self.curves = []
+        self.active = None
+
+    def select(self, index):
+        """Makes the index-th curve active, its points are drawn in ACTIVE_color."""
+        self.active = self.curves[index]
+        for curve in self.curves:
+            curve.points.set_color(ACTIVE_color if curve is self.active else curve.color)
+        if self.background is not None:
+            self.blit()
 
     def connect(self):
         """Connect to all the events we need."""
-        self.cicpick = self.points.figure.canvas.mpl_connect('pick_event', self.on_pick)
-        self.cidpress = self.points.figure.canvas.mpl_connect('button_press_event', self.on_press)
-        self.cidrelease = self.points.figure.canvas.mpl_connect('button_release_event', self.on_release)
-        self.cidmotion = self.points.figure.canvas.mpl_connect('motion_notify_event', self.on_motion)
-        self.cidzoom = self.points.figure.canvas.mpl_connect('scroll_event', self.on_scroll)
+        self.cidpress = self.axes.figure.canvas.mpl_connect('button_press_event', self.on_press)
+        self.cidrelease = self.axes.figure.canvas.mpl_connect('button_release_event', self.on_release)
+        self.cidmotion = self.axes.figure.canvas.mpl_connect('motion_notify_event', self.on_motion)
+        self.cidzoom = self.axes.figure.canvas.mpl_connect('scroll_event', self.on_scroll)
+        self.ciddraw = self.axes.figure.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        """After every full redraw copies the background for blitting and draws the curves and the points on it."""
+        canvas, axes = self.axes.figure.canvas, self.axes
+        self.background = canvas.copy_from_bbox(axes.bbox)
+        self.background_lims = (axes.get_xlim(), axes.get_ylim())
+        profiling.count("redraws")
+        self.draw_artists()
+
+    def blit(self):
+        """
+        Redraws only the curves and the points on top of the copied background.
+        The whole figure (ticks, labels, grid) is redrawn only if the lims have changed since the last full redraw.
+        """
+        canvas, axes = self.axes.figure.canvas, self.axes
+        if self.background is None or self.background_lims != (axes.get_xlim(), axes.get_ylim()):
+            with profiling.span("draw"):
+                canvas.draw()
+            return
+        with profiling.span("blit"):
+            canvas.restore_region(self.background)
+            self.draw_artists()
+            canvas.blit(axes.bbox)
+
+    def draw_artists(self):
+        """Draws the already sampled curves, the active one on top."""
+        for curve in sorted(self.curves, key=lambda c: c is self.active):
+            self.axes.draw_artist(curve.curve)
+            self.axes.draw_artist(curve.points)
+        if self.overlay is not None:
+            self.axes.draw_artist(self.overlay)
 
     def on_press(self, event):
         """
         Creates a new point if the 'Add points' button is checked. Otherwise:
         Creates a new point if the right mouse button was clicked.
+        Deletes or picks up the point under the cursor (see 'pick') if the left mouse button was clicked.
         Begins canvas movement if the left mouse button was clicked and 'Add points' and 'Auto adjust' are not checked.
-        Exception: event.xdata is in self.xs --> does not create a new point because the curve would not be defined.
+        Exception: event.xdata is in the store --> does not create a new point because the curve would not be defined.
+        Points are added to, deleted from and picked up on the active curve only.
         """
-        if event.inaxes != self.points.axes or self.moving_point:
+        if event.inaxes != self.axes or self.moving_point:
             return
 
-        if (MyApp.add_point or event.button == 3) and event.xdata not in self.xs:    # create a new point
-            update_coords_add(self.xs, self.ys, event.xdata, event.ydata)   # keep xs sorted
-            self.create_spline(self.xs, self.ys)
+        if event.button == 1 and not MyApp.add_point and self.press is None:
+            ind = self.hit_test(event)
+            if ind >= 0:
+                self.pick(ind)
+                return
+
+        store = self.active.store
+        if (MyApp.add_point or event.button == 3) and store.accepts(event.xdata, event.ydata):  # a new point
+            store.insert(event.xdata, event.ydata)   # keeps xs sorted (appends in the parametric mode)
+            self.create_spline(self.active)
 
         elif event.button == 1 and not MyApp.auto_adjust:  # left mouse button --> begin canvas movement
             self.moving_canvas = True
-            # redraw the whole spline (so that we don't have to redraw it while moving the canvas)
-            self.create_spline(self.xs, self.ys)
+            # redraw the whole splines (so that we don't have to redraw them while moving the canvas)
+            self.resample()
             self.press = (event.xdata, event.ydata)
 
-    def on_pick(self, event):
+    def hit_test(self, event):
+        """Returns the index of the point nearest to the mouse within PICK_radius, -1 if there is no such point."""
+        axes = self.axes
+        (xmin, xmax), (ymin, ymax) = axes.get_xlim(), axes.get_ylim()
+        radius = PICK_radius * axes.figure.dpi / 72     # in pixels
+        rx = radius * (xmax - xmin) / axes.bbox.width      # in data units
+        ry = radius * abs(ymax - ymin) / axes.bbox.height
+        return self.active.store.nearest(event.xdata, event.ydata, abs(rx), ry)
+
+    def pick(self, ind):
         """
-        Deletes the selected point if the 'Delete points' button checked.
+        Deletes the ind-th point if the 'Delete points' button checked.
         Begins point movement if the 'Move points' button checked.
-        Works only for left mouse button.
         """
-        if self.press is not None or MyApp.add_point or event.mouseevent.button != 1:
-            return
-
-        ind = event.ind[0]  # point index
-        x = self.points.get_xdata()[ind]    # coords of the point
-        y = self.points.get_ydata()[ind]
+        store = self.active.store
+        x, y = store.xs[ind], store.ys[ind]   # coords of the point
 
         if MyApp.delete_point:  # delete the point
-            update_coords_del(self.xs, self.ys, x)
-            self.create_spline(self.xs, self.ys)
+            store.delete(ind)
+            self.create_spline(self.active)
         elif MyApp.move_point_or_canvas:   # begin point movement
             self.press = (x, y)
             self.moving_point = True
+            self.moving = ind
             self.app.slider.setEnabled(False)   # disable changing degree
+            if len(store) >= 2 and not MyApp.parametric:  # keep the factorization of the SoLE while moving
+                self.drag = DragSession(store.xs, store.ys, self.active.degree, ind, self.worker.cache)
 
     def on_motion(self, event):
         """ Changes axes lims if moving_canvas, draws spline curves if moving_point."""
-        if self.press is None or event.inaxes != self.points.axes:
+        if self.press is None or event.inaxes != self.axes:
             return
         xlast, ylast = self.press
 
         if self.moving_canvas:
             dx, dy = event.xdata - xlast, event.ydata - ylast
-            self.points.axes.set_xlim([x - dx for x in self.points.axes.get_xlim()])
-            self.points.axes.set_ylim([y - dy for y in self.points.axes.get_ylim()])
+            self.axes.set_xlim([x - dx for x in self.axes.get_xlim()])
+            self.axes.set_ylim([y - dy for y in self.axes.get_ylim()])
             self.app.update_displayed_lims()
-            self.points.figure.canvas.draw()
+            xmin, xmax = self.axes.get_xlim()
+            for curve in self.curves:
+                if curve.sampled is not None and (xmin < curve.sampled[0] or curve.sampled[1] < xmax):
+                    self.create_spline(curve, curve.polynomials)    # sample the exposed part
+            self.axes.figure.canvas.draw_idle()   # the lims have changed, redraw everything once Qt is idle
 
         elif self.moving_point:
-            if event.xdata not in self.xs:  # update coords if the new x coordinate is valid
-                update_coords_del(self.xs, self.ys, xlast)
-                update_coords_add(self.xs, self.ys, event.xdata, event.ydata)
-                self.press = (event.xdata, event.ydata)     # remember the coord if they are valid
-            self.create_spline(self.xs, self.ys)
+            j, store = self.moving, self.active.store
+            try:
+                i = store.move(j, event.xdata, event.ydata)
+            except ValueError:  # the new coords are not valid
+                self.create_spline(self.active, self.active.polynomials)
+                return
+            self.moving = i
+            self.press = (event.xdata, event.ydata)     # remember the coord if they are valid
+            if self.drag is not None and i != j:    # the point moved past its neighbour --> factorize the new SoLE
+                self.drag = DragSession(store.xs, store.ys, self.active.degree, i, self.worker.cache)
+            # if the order of points didn't change, the spline is updated using the old factorization
+            self.create_spline(self.active, drag=self.drag)
 
     def on_release(self, event):
         """Stops canvas movement or point movement."""
-        if self.press is None or event.inaxes != self.points.axes:
+        if self.press is None or event.inaxes != self.axes:
             return
 
         if self.moving_canvas:
             self.moving_canvas = False
-            self.create_spline(self.xs, self.ys)
+            self.resample()
         elif self.moving_point:
             self.moving_point = False
+            self.moving = None
+            self.drag = None
             self.app.slider.setEnabled(True)   # enable changing degree
         self.press = None
 
     def on_scroll(self, event):
         """Zooms in and out based on 'ZOOM' by scaling the x and y lims accordingly.
         Doesn't zoom if 'Auto adjust' is checked."""
-        if event.inaxes != self.points.axes or MyApp.auto_adjust:
+        if event.inaxes != self.axes or MyApp.auto_adjust:
             return
 
         margin = (ZOOM - 1) / 2     # how much to add on both sides
-        (xmin, xmax), (ymin, ymax) = self.points.axes.get_xlim(), self.points.axes.get_ylim()
+        (xmin, xmax), (ymin, ymax) = self.axes.get_xlim(), self.axes.get_ylim()
         xleft, xright, ydown, yup = event.xdata - xmin, xmax - event.xdata, event.ydata - ymin, ymax - event.ydata
 
         if event.button == "down":  # zoom out
@@ -154,55 +440,97 @@ class SplineCurvesBuilder:
             xlim = (xmin + margin * xleft, xmax - margin * xright)
             ylim = (ymin + margin * ydown, ymax - margin * yup)
 
-        self.points.axes.set_xlim(xlim)
-        self.points.axes.set_ylim(ylim)
+        self.axes.set_xlim(xlim)
+        self.axes.set_ylim(ylim)
         self.app.update_displayed_lims()
-        self.create_spline(self.xs, self.ys)
-
-    def create_spline(self, xs, ys):
-        """Calculates polynomials and draws the spline function for the coords given."""
-        xs, ys = np.array(xs), np.array(ys)
-        xlim = self.points.axes.get_xlim()  # save old lims
-        ylim = self.points.axes.get_ylim()
-        self.points.axes.cla()
-        if not MyApp.auto_adjust:  # set old lims if auto_adjust is off
-            self.points.axes.set_xlim(xlim)
-            self.points.axes.set_ylim(ylim)
-
-        if len(xs) >= 2:        # calculate spline if it is defined
-            self.polynomials = spline(xs, ys, self.degree)
-            if MyApp.auto_adjust:   # the graph takes up all screen
-                t = np.sort(np.concatenate([xs, np.linspace(xs[0], xs[-1], 1+int(self.app.width()))]))
-            # it would be slow to redraw the spline while moving, so we
-            # just draw it with a lot of points and that only change lims
-            elif self.moving_canvas:
-                freq = max(MIN_freq, MIN_INTERVAL_num_points / min_interval(xs))
-                # len(t) ~ freq * (xs[-1] - xs[0])
-                freq = min(freq, MAX_len_linspace / (xs[-1] - xs[0]))
-                t = np.sort(np.concatenate([xs, np.linspace(xs[0], xs[-1], 1+int(freq * (xs[-1] - xs[0])))]))
-            else:
-                xmin, xmax = max(xlim[0], xs[0]), min(xlim[1], xs[-1])
-                xrange, xmaxrange = xmax - xmin, xlim[1] - xlim[0]
-                c = 0 if xrange < 0 else xrange / xmaxrange   # c = 0 if all points are off screen
-                t = np.sort(np.concatenate([xs, np.linspace(xmin, xmax, 1+int(c * self.app.width()))]))
+        self.resample()
 
-            s = t.copy()
-            start = 0
-            for i in range(len(xs)-1):
-                end = binary_search(t, xs[i+1])
-                s[start:end+1] = self.polynomials[i](t[start:end+1])
-                start = end
-            self.points.axes.plot(t, s)
+    def resample(self):
+        """Samples all curves again for the current view, the fitted splines are reused."""
+        for curve in self.curves:
+            self.create_spline(curve, curve.current_polynomials())
 
-        # draw the points, picker=True allows us to use the 'pick_event'
-        self.points, = self.points.axes.plot(xs, ys, "o", c="r", picker=True, pickradius=5)
-        self.points.figure.canvas.draw()
+    def create_spline(self, curve, polynomials=None, drag=None):
+        """
+        Draws the points of 'curve' and lets the worker calculate and sample its spline function.
+        If 'polynomials' are given, they are only sampled. If 'drag' (DragSession) is given, it is used to calculate
+        the polynomials. The curve is drawn by 'draw_curve' once it is ready.
+        """
+        xs, ys = np.array(curve.store.xs), np.array(curve.store.ys)
+        xlim = self.axes.get_xlim()
+        ylim = self.axes.get_ylim()
+        curve.points.set_data(xs, ys)
+
+        if len(xs) < 2:     # the spline is not defined
+            self.worker.cancel(curve)
+            curve.polynomials = None
+            curve.sampled = None
+            curve.curve.set_data([], [])
+            self.show(MyApp.auto_adjust)
+            return
+
+        width, height = self.axes.bbox.width, self.axes.bbox.height   # in pixels
+        if MyApp.auto_adjust:   # the graph takes up all screen, the y lims will be at least the range of ys
+            xrange = (-np.inf, np.inf) if MyApp.parametric else (xs[0], xs[-1])
+            yscale = height / max(np.ptp(ys), np.finfo(float).eps)
+            xscale = width / max(np.ptp(xs), np.finfo(float).eps)
+        elif MyApp.parametric:      # the whole curve is sampled
+            xrange, yscale = (-np.inf, np.inf), height / (ylim[1] - ylim[0])
+            xscale = width / (xlim[1] - xlim[0])
+        elif self.moving_canvas:    # sample around the view too, so that it isn't resampled after every move
+            margin = PAN_margin * (xlim[1] - xlim[0])
+            xrange, yscale = (xlim[0] - margin, xlim[1] + margin), height / (ylim[1] - ylim[0])
+            xscale = width / (xlim[1] - xlim[0])
+        else:   # draw only the visible part of the spline
+            xrange, yscale = xlim, height / (ylim[1] - ylim[0])
+            xscale = width / (xlim[1] - xlim[0])
+        self.worker.submit(SplineRequest(curve, xs, ys, curve.degree, xrange, xscale, yscale, MyApp.auto_adjust,
+                                         polynomials, drag, MyApp.parametric))
+        self.show(False)    # show the points right away
+
+    def draw_curve(self, result):
+        """Draws the curve calculated by the worker unless a newer one has been requested."""
+        request, polynomials, t, s = result
+        curve = request.curve
+        if not self.worker.is_latest(request) or curve not in self.curves:
+            return
+        curve.polynomials = polynomials
+        curve.fitted = request
+        curve.sampled = request.xrange
+        curve.curve.set_data(t, s)
+        if self.overlay is not None:
+            self.update_overlay(request, len(t))
+        self.show(request.auto_adjust)
+        if request.auto_adjust:
+            self.app.update_displayed_lims()
+
+    def update_overlay(self, request, samples):
+        """Shows the frames per second, the latency of 'request' and the durations of the last stages."""
+        now = time.perf_counter()
+        self.frames.append(now)
+        while now - self.frames[0] > 1:
+            self.frames.popleft()
+        lines = [f"{len(self.frames):>3} FPS  latency {(now - request.submitted) * 1e3:6.1f} ms  {samples} samples"]
+        for name in ("assemble", "factorize", "solve", "sample", "evaluate", "blit", "draw"):
+            duration = profiling.last(name)
+            if duration is not None:
+                lines.append(f"{name:>9} {duration * 1e3:8.2f} ms")
+        self.overlay.set_text("\n".join(lines))
+
+    def show(self, auto_adjust):
+        """Blits the curves and the points, fits the lims to them first if 'auto_adjust' is True."""
+        if auto_adjust:
+            self.axes.set_autoscale_on(True)
+            self.axes.relim()
+            self.axes.autoscale_view()
+        self.blit()
 
 
 class Canvas(FigureCanvas):
     """Ensures communication between the matplotlib figure and PyQt5 GUI."""
     def __init__(self, parent):     # parent is the QtWidget object the figure will be embedded in
-        self.fig, self.ax = plt.subplots()
+        self.fig = Figure()     # pyplot isn't needed, the figure is embedded in the Qt window
+        self.ax = self.fig.add_subplot()
         super().__init__(self.fig)
         self.setParent(parent)
         self.parent = parent
@@ -212,8 +540,7 @@ class Canvas(FigureCanvas):
         """Create the SplineCurvesBuilder object and set default parameters."""
         self.ax.set_xlim(DEFAULT_xmin, DEFAULT_xmax)
         self.ax.set_ylim(DEFAULT_ymin, DEFAULT_ymax)
-        empty_point, = self.ax.plot([0], [0])
-        self.spl = SplineCurvesBuilder(empty_point, self.parent)
+        self.spl = SplineCurvesBuilder(self.ax, self.parent)
         self.spl.connect()
 
     def get_xlim(self):
@@ -231,19 +558,50 @@ class Canvas(FigureCanvas):
         self.fig.canvas.draw()
 
     def redraw(self):
-        self.spl.create_spline(self.spl.xs, self.spl.ys)
+        """Draws all curves again, only the curves whose points or degree changed are fitted again."""
+        self.spl.resample()
 
     def set_equal_axes(self):
-        self.spl.points.axes.axis('equal')
+        self.ax.axis('equal')
         self.redraw()
 
     def set_auto_axes(self):
-        self.spl.points.axes.axis('auto')
+        self.ax.axis('auto')
         self.redraw()
 
     def delete_all_points(self):
-        self.spl.xs = []
-        self.spl.ys = []
+        """Deletes the points of the active curve."""
+        self.spl.active.store.clear()
+        self.spl.create_spline(self.spl.active)
+
+    def save(self, path):
+        """Saves the points, the degrees and the drawn splines of all curves, the lims and the mode to 'path'."""
+        curves = [{"xs": c.store.xs, "ys": c.store.ys, "degree": c.degree, "polynomials": c.current_polynomials()}
+                  for c in self.spl.curves]
+        save_session(path, curves, self.get_xlim(), self.get_ylim(), MyApp.parametric)
+
+    def load(self, session):
+        """Replaces the curves by the curves of a session loaded by 'load_session' and restores its lims."""
+        self.spl.remove_curves()
+        self.ax.set_xlim(session["xlim"])
+        self.ax.set_ylim(session["ylim"])
+        for saved in session["curves"] or [{"xs": [], "ys": [], "degree": DEFAULT_deg, "polynomials": None}]:
+            curve = self.spl.add_curve(saved["degree"])
+            curve.store = PathStore(saved["xs"], saved["ys"]) if session["parametric"] else \
+                PointStore(saved["xs"], saved["ys"])
+            self.spl.create_spline(curve, saved["polynomials"])
+        self.spl.select(0)
+
+    def set_parametric(self, parametric):
+        """Switches the stores of the points. Points with repeated x coordinates are dropped for the function mode."""
+        for curve in self.spl.curves:
+            xs, ys = curve.store.xs, curve.store.ys
+            if parametric:
+                curve.store = PathStore(xs, ys)     # the curve goes through the points from left to right
+            else:
+                xs, first = np.unique(xs, return_index=True)
+                curve.store = PointStore(xs, ys[first])
+            curve.polynomials = None
         self.redraw()
 
 
@@ -254,6 +612,8 @@ class MyApp(QWidget):
     move_point_or_canvas = False
     auto_adjust = False     # True if the 'Auto adjust' checkbox is checked
     equal_axes = False      # True if the 'Equal axes' checkbox is checked
+    show_overlay = False    # True if the FPS and timings are shown on the canvas
+    parametric = False      # True if the 'Parametric' checkbox is checked
 
     def __init__(self):
         super().__init__()
@@ -298,6 +658,23 @@ class MyApp(QWidget):
         self.delete_all_button.clicked.connect(self.delete_all_popup)
         self.topLayout.addWidget(self.delete_all_button)
 
+        # create the 'New curve' button and the list of the curves
+        self.new_curve_button = QPushButton("New curve", self)
+        self.new_curve_button.clicked.connect(self.clicked_new_curve)
+        self.topLayout.addWidget(self.new_curve_button)
+        self.curve_list = QComboBox(self)
+        self.curve_list.addItem("Curve 1")
+        self.curve_list.currentIndexChanged.connect(self.selected_curve)
+        self.topLayout.addWidget(self.curve_list)
+
+        # create the 'Save' and 'Open' buttons
+        self.save_button = QPushButton("Save", self)
+        self.save_button.clicked.connect(self.clicked_save)
+        self.topLayout.addWidget(self.save_button)
+        self.open_button = QPushButton("Open", self)
+        self.open_button.clicked.connect(self.clicked_open)
+        self.topLayout.addWidget(self.open_button)
+
         # create the 'x min' input line
         self.xmin_input = QLineEdit()
         self.xmin_input.setText(str(DEFAULT_xmin))
@@ -359,6 +736,11 @@ class MyApp(QWidget):
         self.equalAxes.stateChanged.connect(self.checked_equalAxes)
         self.topLayout.addWidget(self.equalAxes)
 
+        # create the 'Parametric' checkbox
+        self.parametricCurve = QCheckBox("Parametric")
+        self.parametricCurve.stateChanged.connect(self.checked_parametric)
+        self.topLayout.addWidget(self.parametricCurve)
+
         # create the matplotlib graph
         self.canvas = Canvas(self)
         self.layout.addWidget(self.canvas)
@@ -392,13 +774,65 @@ class MyApp(QWidget):
         """Creates a pup-up window to make sure that the user wants to delete all of the points."""
         popup = QMessageBox()
         popup.setWindowTitle("Delete all points")
-        popup.setText("Are you sure you want to delete all points?")
+        popup.setText("Are you sure you want to delete all points of the active curve?")
         popup.setIcon(QMessageBox.Question)
         popup.setStandardButtons(QMessageBox.Cancel | QMessageBox.Yes)
         popup.setDefaultButton(QMessageBox.Cancel)
         popup.buttonClicked.connect(self.delete_all_popup_button_clicked)
         x = popup.exec()
 
+    def clicked_save(self):
+        """Asks for a file and saves the session there."""
+        path, _ = QFileDialog.getSaveFileName(self, "Save session", "", f"Spline sessions (*{EXTENSION})")
+        if not path:
+            return
+        if not path.endswith(EXTENSION):
+            path += EXTENSION
+        try:
+            self.canvas.save(path)
+        except OSError as e:
+            QMessageBox.warning(self, "Save session", f"The session could not be saved:\n{e}")
+
+    def clicked_open(self):
+        """Asks for a file saved by 'clicked_save' and restores the session from it."""
+        path, _ = QFileDialog.getOpenFileName(self, "Open session", "", f"Spline sessions (*{EXTENSION})")
+        if not path:
+            return
+        try:
+            session = load_session(path)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, "Open session", f"The session could not be opened:\n{e}")
+            return
+        self.parametricCurve.blockSignals(True)     # the session is drawn once by 'Canvas.load'
+        self.parametricCurve.setChecked(session["parametric"])
+        self.parametricCurve.blockSignals(False)
+        MyApp.parametric = session["parametric"]
+        self.canvas.load(session)
+        self.curve_list.blockSignals(True)
+        self.curve_list.clear()
+        self.curve_list.addItems([f"Curve {i+1}" for i in range(len(self.canvas.spl.curves))])
+        self.curve_list.blockSignals(False)
+        self.show_degree(self.canvas.spl.active.degree)
+        self.update_displayed_lims()
+
+    def clicked_new_curve(self):
+        """Adds a new curve with the degree of the active one and makes it active."""
+        self.canvas.spl.add_curve(self.canvas.spl.active.degree)
+        self.curve_list.addItem(f"Curve {len(self.canvas.spl.curves)}")
+        self.curve_list.setCurrentIndex(len(self.canvas.spl.curves) - 1)
+
+    def selected_curve(self, index):
+        """Makes the selected curve active, the slider shows its degree."""
+        if index < 0:   # the list is being cleared
+            return
+        self.canvas.spl.select(index)
+        self.show_degree(self.canvas.spl.active.degree)
+
+    def closeEvent(self, event):
+        self.canvas.spl.worker.stop()
+        profiling.finish()
+        super().closeEvent(event)
+
     def delete_all_popup_button_clicked(self, button):
         if button.text() == "&Yes":
             self.canvas.delete_all_points()
@@ -435,12 +869,24 @@ class MyApp(QWidget):
             self.update_ymax()
         self.canvas.redraw()
 
+    def checked_parametric(self, checked):
+        """Switches between the spline function y(x) and the parametric spline curve (x(t), y(t))."""
+        MyApp.parametric = bool(checked)
+        self.canvas.set_parametric(MyApp.parametric)
+
     def changed_degree(self):
-        """Changes the degree of the spline function."""
+        """Changes the degree of the active curve, the other curves are not fitted again."""
         deg = 2*self.slider.value() - 1   # we want only odd degrees
         self.label.setText(f"&Degree: {deg}   ")
-        self.canvas.spl.degree = deg
-        self.canvas.redraw()
+        self.canvas.spl.active.degree = deg
+        self.canvas.spl.create_spline(self.canvas.spl.active)
+
+    def show_degree(self, deg):
+        """Moves the slider to 'deg' without changing the degree of any curve."""
+        self.slider.blockSignals(True)
+        self.slider.setValue((deg + 1) // 2)
+        self.slider.blockSignals(False)
+        self.label.setText(f"&Degree: {deg}   ")
 
     def update_xmin(self):
         """Updates xmin according to the xmin input line."""
@@ -505,8 +951,21 @@ class MyApp(QWidget):
         self.ymax_input.setEnabled(enabled)
 
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Interactive spline curves.")
+    parser.add_argument("--trace", default=os.environ.get("SPLINE_TRACE"),
+                        help="write a Chrome trace of the session to this file (or set SPLINE_TRACE)")
+    parser.add_argument("--overlay", action="store_true", default=bool(os.environ.get("SPLINE_OVERLAY")),
+                        help="show the FPS and timings of the stages on the canvas (or set SPLINE_OVERLAY=1)")
+    return parser.parse_known_args(argv)    # the rest is for Qt
+
+
 def main():
-    app = QApplication(sys.argv)
+    args, qt_args = parse_args(sys.argv[1:])
+    if args.trace or args.overlay:
+        profiling.enable(args.trace)
+    MyApp.show_overlay = args.overlay
+    app = QApplication(sys.argv[:1] + qt_args)
     myApp = MyApp()
     myApp.show()
 
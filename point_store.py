@@ -0,0 +1,306 @@
+import numpy as np
+from heapq import heapify, heappush, heappop
+
+MIN_capacity = 16
+MAX_cell_ratio = 4  # the grid of PathStore is rebuilt if the pick radius differs from its cells more than this
+
+
+class PointStore:
+    """
+    Keeps points (x, y) sorted by x in contiguous NumPy arrays.
+
+    'xs' and 'ys' are views of the stored arrays, so they can be passed to the solver without copying.
+    The views are only valid until the next change of the store.
+    The x coordinates are unique: membership is tested by binary search in O(log n) and the minimal distance
+    of two adjacent x coordinates is maintained in a heap of gaps, so it doesn't have to be recomputed.
+    """
+    def __init__(self, xs=(), ys=()):
+        self._x = np.empty(MIN_capacity)
+        self._y = np.empty(MIN_capacity)
+        self.n = 0          # number of points
+        self._gaps = []     # heap of (x[i+1] - x[i], x[i], x[i+1]), may contain gaps which no longer exist
+        if len(xs):
+            self.insert_many(xs, ys)
+
+    @property
+    def xs(self):
+        return self._x[:self.n]
+
+    @property
+    def ys(self):
+        return self._y[:self.n]
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, x):
+        return self.index(x) >= 0
+
+    def accepts(self, x, y):
+        """Returns True if the point (x, y) can be inserted."""
+        return x not in self
+
+    def nearest(self, x, y, rx, ry):
+        """
+        Returns the index of the point nearest to (x, y) within the ellipse with the half-axes 'rx' and 'ry',
+        -1 if there is no such point. The distance is measured in units of the half-axes, so with rx and ry being
+        the pick radius in data units, it is the distance on the screen.
+        The points are sorted by x, so only the points with x in [x - rx, x + rx] are checked, in O(log n + k).
+        """
+        lo, hi = np.searchsorted(self.xs, [x - rx, x + rx], side="left")
+        hi = max(hi, int(np.searchsorted(self.xs, x + rx, side="right")))
+        return nearest_in(self._x, self._y, np.arange(lo, hi), x, y, rx, ry)
+
+    def index(self, x):
+        """Returns the index of the point with the x coordinate 'x' or -1 if there is no such point."""
+        i = int(np.searchsorted(self.xs, x))
+        return i if i < self.n and self._x[i] == x else -1
+
+    def insert(self, x, y):
+        """Inserts the point (x, y) and returns its index. Raises ValueError if 'x' is already in the store."""
+        i = int(np.searchsorted(self.xs, x))
+        if i < self.n and self._x[i] == x:
+            raise ValueError(f"x = {x} is already in the store")
+        self._reserve(self.n + 1)
+        self._x[i+1:self.n+1] = self._x[i:self.n]     # shift the tail of the arrays
+        self._y[i+1:self.n+1] = self._y[i:self.n]
+        self._x[i], self._y[i] = x, y
+        self.n += 1
+        self._push_gaps(i-1, i+1)
+        return i
+
+    def insert_many(self, xs, ys):
+        """Inserts all points (xs[i], ys[i]) at once. Raises ValueError if any x coordinate would be repeated."""
+        xs, ys = np.asarray(xs, dtype=float).ravel(), np.asarray(ys, dtype=float).ravel()
+        order = np.argsort(xs, kind="stable")
+        xs, ys = xs[order], ys[order]
+        pos = np.searchsorted(self.xs, xs)
+        inside = pos < self.n
+        if np.any(xs[1:] == xs[:-1]) or np.any(self._x[pos[inside]] == xs[inside]):
+            raise ValueError("x coordinates of the points must be unique")
+        x, y = np.insert(self.xs, pos, xs), np.insert(self.ys, pos, ys)
+        self._reserve(len(x))
+        self.n = len(x)
+        self._x[:self.n], self._y[:self.n] = x, y
+        if len(xs) > self.n // 2:
+            self._rebuild_gaps()
+        else:
+            for i in pos + np.arange(len(xs)):     # indices of the new points
+                self._push_gaps(i-1, i+1)
+
+    def delete(self, i):
+        """Deletes the i-th point."""
+        self._x[i:self.n-1] = self._x[i+1:self.n]
+        self._y[i:self.n-1] = self._y[i+1:self.n]
+        self.n -= 1
+        self._push_gaps(i-1, i)
+
+    def delete_many(self, indices):
+        """Deletes the points with the given indices at once."""
+        keep = np.ones(self.n, dtype=bool)
+        keep[indices] = False
+        x, y = self.xs[keep], self.ys[keep]
+        self.n = len(x)
+        self._x[:self.n], self._y[:self.n] = x, y
+        if self.n < len(keep) // 2:
+            self._rebuild_gaps()
+        else:
+            for i in np.unique(np.cumsum(keep)[np.flatnonzero(~keep)]):   # new indices of the points after the holes
+                self._push_gaps(i-1, i)
+
+    def move(self, i, x, y):
+        """
+        Moves the i-th point to (x, y) and returns its new index.
+        The arrays are only shifted if the point moves past one of its neighbours.
+        Raises ValueError if 'x' is the x coordinate of another point.
+        """
+        if (i == 0 or self._x[i-1] < x) and (i == self.n-1 or x < self._x[i+1]):
+            self._x[i], self._y[i] = x, y
+            self._push_gaps(i-1, i+1)
+            return i
+        if x in self:
+            raise ValueError(f"x = {x} is already in the store")
+        self.delete(i)
+        return self.insert(x, y)
+
+    def clear(self):
+        self.n = 0
+        self._gaps = []
+
+    @property
+    def min_gap(self):
+        """The minimal distance of two adjacent x coordinates, None if there are less than two points."""
+        while self._gaps:
+            gap, left, right = self._gaps[0]
+            i = self.index(left)
+            if i >= 0 and i+1 < self.n and self._x[i+1] == right:
+                return gap
+            heappop(self._gaps)     # the gap doesn't exist anymore
+        return None
+
+    def _push_gaps(self, start, end):
+        """Pushes the gaps between the points start, start+1, ... end to the heap."""
+        for i in range(max(start, 0), min(end, self.n-1)):
+            left, right = float(self._x[i]), float(self._x[i+1])
+            heappush(self._gaps, (right - left, left, right))
+        if len(self._gaps) > 2*self.n + MIN_capacity:   # too many gaps which no longer exist
+            self._rebuild_gaps()
+
+    def _rebuild_gaps(self):
+        x = self.xs
+        self._gaps = list(zip(np.diff(x).tolist(), x[:-1].tolist(), x[1:].tolist()))
+        heapify(self._gaps)
+
+    def _reserve(self, size):
+        """Makes sure that there is space for 'size' points, the capacity is doubled if needed."""
+        if size <= len(self._x):
+            return
+        capacity = max(size, 2*len(self._x))
+        for name in ("_x", "_y"):
+            a = np.empty(capacity)
+            a[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, a)
+
+
+class PathStore:
+    """
+    Keeps the points of a parametric curve in the order in which they were added, in contiguous NumPy arrays.
+
+    It has the same interface as 'PointStore', but the points can have the same x coordinates, only two consecutive
+    points must differ. New points are appended in amortized O(1), no order has to be maintained.
+    The points are also kept in a grid of cells (created by the first call of 'nearest'), which is updated
+    when a point is appended or moved, so hit-testing only checks the points near the click.
+    """
+    def __init__(self, xs=(), ys=()):
+        self._x = np.empty(MIN_capacity)
+        self._y = np.empty(MIN_capacity)
+        self.n = 0          # number of points
+        self.grid = None    # PointGrid of the points, None until it is needed
+        if len(xs):
+            self.insert_many(xs, ys)
+
+    @property
+    def xs(self):
+        return self._x[:self.n]
+
+    @property
+    def ys(self):
+        return self._y[:self.n]
+
+    def __len__(self):
+        return self.n
+
+    def accepts(self, x, y):
+        """Returns True if the point (x, y) can be appended."""
+        return self.n == 0 or (self._x[self.n-1], self._y[self.n-1]) != (x, y)
+
+    def insert(self, x, y):
+        """Appends the point (x, y) and returns its index. Raises ValueError if it is the same as the last point."""
+        if not self.accepts(x, y):
+            raise ValueError(f"({x}, {y}) is the same as the last point")
+        self._reserve(self.n + 1)
+        self._x[self.n], self._y[self.n] = x, y
+        self.n += 1
+        if self.grid is not None:
+            self.grid.add(self.n - 1, x, y)
+        return self.n - 1
+
+    def insert_many(self, xs, ys):
+        """Appends all points (xs[i], ys[i]) in the given order."""
+        xs, ys = np.asarray(xs, dtype=float).ravel(), np.asarray(ys, dtype=float).ravel()
+        x, y = np.append(self.xs, xs), np.append(self.ys, ys)
+        if np.any((x[1:] == x[:-1]) & (y[1:] == y[:-1])):
+            raise ValueError("consecutive points must differ")
+        self._reserve(len(x))
+        self.n = len(x)
+        self._x[:self.n], self._y[:self.n] = x, y
+        self.grid = None
+
+    def delete(self, i):
+        """Deletes the i-th point."""
+        self.delete_many([i])
+
+    def delete_many(self, indices):
+        """Deletes the points with the given indices at once, consecutive duplicates left behind are merged."""
+        keep = np.ones(self.n, dtype=bool)
+        keep[indices] = False
+        x, y = self.xs[keep], self.ys[keep]
+        distinct = np.append(True, (x[1:] != x[:-1]) | (y[1:] != y[:-1]))
+        self.n = int(distinct.sum())
+        self._x[:self.n], self._y[:self.n] = x[distinct], y[distinct]
+        self.grid = None    # the indices have changed, the grid is rebuilt when it is needed
+
+    def move(self, i, x, y):
+        """
+        Moves the i-th point to (x, y) and returns its index, which doesn't change.
+        Raises ValueError if (x, y) is one of its neighbours.
+        """
+        if (i > 0 and (self._x[i-1], self._y[i-1]) == (x, y)) or \
+           (i < self.n-1 and (self._x[i+1], self._y[i+1]) == (x, y)):
+            raise ValueError(f"({x}, {y}) is the same as a neighbouring point")
+        if self.grid is not None:
+            self.grid.remove(i, self._x[i], self._y[i])
+            self.grid.add(i, x, y)
+        self._x[i], self._y[i] = x, y
+        return i
+
+    def clear(self):
+        self.n = 0
+        self.grid = None
+
+    def nearest(self, x, y, rx, ry):
+        """
+        Returns the index of the point nearest to (x, y) within the ellipse with the half-axes 'rx' and 'ry',
+        -1 if there is no such point, see 'PointStore.nearest'. Only the points in the cells around (x, y) are checked.
+        """
+        if self.grid is None or not self.grid.suits(rx, ry):
+            self.grid = PointGrid(self.xs, self.ys, rx, ry)
+        return nearest_in(self._x, self._y, self.grid.candidates(x, y, rx, ry), x, y, rx, ry)
+
+    _reserve = PointStore._reserve
+
+
+class PointGrid:
+    """
+    Uniform grid of cells of size (width, height) in data units, every cell holds the indices of the points in it.
+    Points can be added and removed in O(1). The cells are created for a pick radius, so that a query only checks
+    the 3 x 3 cells around the point.
+    """
+    def __init__(self, xs, ys, width, height):
+        self.width = width
+        self.height = height
+        self.cells = {}     # (column, row) -> set of indices
+        columns, rows = np.floor(xs / width).astype(int), np.floor(ys / height).astype(int)
+        for i, cell in enumerate(zip(columns.tolist(), rows.tolist())):
+            self.cells.setdefault(cell, set()).add(i)
+
+    def cell(self, x, y):
+        return int(np.floor(x / self.width)), int(np.floor(y / self.height))
+
+    def suits(self, rx, ry):
+        """Returns True if the cells are not too small nor too big for queries with the radii rx, ry."""
+        return (1 / MAX_cell_ratio <= rx / self.width <= 1) and (1 / MAX_cell_ratio <= ry / self.height <= 1)
+
+    def add(self, i, x, y):
+        self.cells.setdefault(self.cell(x, y), set()).add(i)
+
+    def remove(self, i, x, y):
+        cell = self.cell(x, y)
+        self.cells[cell].discard(i)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def candidates(self, x, y, rx, ry):
+        """Returns the indices of the points in the cells which intersect the box [x +- rx] x [y +- ry]."""
+        (c0, r0), (c1, r1) = self.cell(x - rx, y - ry), self.cell(x + rx, y + ry)
+        found = [i for c in range(c0, c1+1) for r in range(r0, r1+1) for i in self.cells.get((c, r), ())]
+        return np.array(found, dtype=int)
+
+
+def nearest_in(xs, ys, candidates, x, y, rx, ry):
+    """Returns the candidate nearest to (x, y) in the units of the radii rx, ry if it is within them, else -1."""
+    if len(candidates) == 0:
+        return -1
+    d = ((xs[candidates] - x) / rx)**2 + ((ys[candidates] - y) / ry)**2
+    k = int(np.argmin(d))
+    return int(candidates[k]) if d[k] <= 1 else -1
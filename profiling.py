@@ -0,0 +1,111 @@
+"""
+Low-overhead instrumentation of the hot paths: timers of the stages, counters and a trace of a whole session.
+
+It is disabled unless 'enable' is called (main.py does so for --trace / --overlay or the SPLINE_TRACE and
+SPLINE_OVERLAY environment variables). When disabled, 'span' returns a shared no-op context manager and 'count'
+returns right away, so the instrumented code only pays for a function call. Example:
+
+    with profiling.span("solve"):
+        ...
+    profiling.count("samples", len(t))
+
+The trace is written in the Chrome trace format, it can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import nullcontext
+
+MAX_events = 10**6      # the trace keeps at most this many events
+
+NULL_span = nullcontext()
+profiler = None         # the active Profiler, None if the instrumentation is disabled
+
+
+class Span:
+    """Context manager which measures the time spent in its block and reports it to the profiler."""
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+
+
+class Profiler:
+    """
+    Collects the durations of spans and the values of counters.
+
+    'last' holds the duration of the last span of every name in seconds and 'counters' the totals of the counters.
+    If 'path' is given, all spans and changes of counters are kept as trace events and 'save' writes them there.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.origin = time.perf_counter()
+        self.last = {}
+        self.counters = {}
+        self.events = []
+        self.lock = threading.Lock()
+
+    def span(self, name):
+        return Span(self, name)
+
+    def record(self, name, start, end):
+        self.last[name] = end - start
+        if self.path is not None and len(self.events) < MAX_events:
+            self.events.append({"name": name, "ph": "X", "ts": (start - self.origin) * 1e6,
+                                "dur": (end - start) * 1e6, "pid": os.getpid(), "tid": threading.get_ident()})
+
+    def count(self, name, value=1):
+        with self.lock:     # counters are updated from the GUI and the worker thread
+            total = self.counters[name] = self.counters.get(name, 0) + value
+        if self.path is not None and len(self.events) < MAX_events:
+            self.events.append({"name": name, "ph": "C", "ts": (time.perf_counter() - self.origin) * 1e6,
+                                "pid": os.getpid(), "args": {name: total}})
+
+    def save(self):
+        """Writes the trace events to 'path'."""
+        names = {t.ident: t.name for t in threading.enumerate()}
+        threads = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                    "args": {"name": names.get(tid, str(tid))}}
+                   for tid in {e["tid"] for e in self.events if "tid" in e}]
+        with open(self.path, "w") as file:
+            json.dump({"traceEvents": threads + self.events, "displayTimeUnit": "ms"}, file)
+
+
+def enable(path=None):
+    """Enables the instrumentation. If 'path' is given, the trace is written there by 'finish'."""
+    global profiler
+    profiler = Profiler(path)
+    return profiler
+
+
+def span(name):
+    """Returns a context manager measuring the time spent in its block under 'name'."""
+    if profiler is None:
+        return NULL_span
+    return Span(profiler, name)
+
+
+def count(name, value=1):
+    """Adds 'value' to the counter 'name'."""
+    if profiler is not None:
+        profiler.count(name, value)
+
+
+def last(name):
+    """Returns the duration of the last span 'name' in seconds, None if it is unknown."""
+    return None if profiler is None else profiler.last.get(name)
+
+
+def finish():
+    """Writes the trace if it was requested."""
+    if profiler is not None and profiler.path is not None:
+        profiler.save()
@@ -0,0 +1,165 @@
+"""
+Fits spline curves to points read from a file and evaluates them without the GUI.
+
+Only numpy is needed, PyQt5 and matplotlib are never imported, so it starts fast and runs on machines without
+a display. Example:
+
+    python3 spline_cli.py points.csv --degree 5 --samples 10000 --output curve.npy
+
+With --knots the spline is fitted to the points in the least-squares sense on that many knot intervals instead
+of interpolating them, which is much faster and smaller for large noisy data sets:
+
+    python3 spline_cli.py measurements.npy --degree 3 --knots 200 --smoothing 0.1 --output curve.npy
+
+--save writes the fitted spline to a binary file (see spline_file.py); such a file can be given instead of the
+points, it is memory-mapped and evaluated without fitting again:
+
+    python3 spline_cli.py points.csv --degree 5 --save fit.spl
+    python3 spline_cli.py fit.spl --samples 10000 --output curve.npy
+"""
+import sys
+import argparse
+import numpy as np
+from spline_functions import spline, least_squares_spline, evaluate_chunked, DEFAULT_chunk
+from spline_file import save_spline, load_spline, EXTENSION
+
+DEGREES = range(3, 14, 2)      # the same degrees as on the slider in the GUI
+DEFAULT_samples = 1000
+
+
+def read_array(path):
+    """
+    Reads an array from a .npy file or from a CSV file (an optional header line is skipped).
+    .npy files are memory-mapped, so they are read only when needed.
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    try:
+        return np.loadtxt(path, delimiter=",", ndmin=2)
+    except ValueError:      # the first line is a header
+        return np.loadtxt(path, delimiter=",", ndmin=2, skiprows=1)
+
+
+def read_points(path, unique=True):
+    """
+    Reads points from a file with two columns (x and y) and returns them sorted by x.
+    If 'unique' is True, the x coordinates must not repeat.
+    """
+    points = read_array(path)
+    if points.ndim != 2 or 2 not in points.shape:
+        raise ValueError(f"expected two columns of x and y coordinates, got an array of shape {points.shape}")
+    if points.shape[1] != 2:    # two rows
+        points = points.T
+    xs, ys = points[:, 0], points[:, 1]
+    order = np.argsort(xs)
+    xs, ys = xs[order], ys[order]
+    if len(xs) < 2:
+        raise ValueError("at least two points are needed")
+    if unique and np.any(xs[1:] == xs[:-1]):
+        raise ValueError("x coordinates of the points must be unique")
+    return xs, ys
+
+
+class Linspace:
+    """Evenly spaced points like np.linspace, but a slice of them is only computed when it is needed."""
+    def __init__(self, start, stop, num):
+        self.start, self.num = start, num
+        self.step = (stop - start) / (num - 1) if num > 1 else 0
+
+    def __len__(self):
+        return self.num
+
+    def __getitem__(self, s):
+        return self.start + self.step * np.arange(*s.indices(self.num))
+
+
+def sample_grid(xs, args):
+    """Returns the points where the spline is evaluated according to the command line arguments."""
+    if args.grid is not None:
+        return read_array(args.grid).reshape(-1)
+    if args.density is not None:
+        return Linspace(xs[0], xs[-1], 1 + int(args.density * (xs[-1] - xs[0])))
+    return Linspace(xs[0], xs[-1], args.samples)
+
+
+def write_result(f, t, path, chunk_size):
+    """
+    Evaluates the spline 'f' at 't' and writes two columns (t, s) to a .npy file, raw little-endian float64 or CSV.
+    The results are written chunk by chunk to memory-mapped files, so the memory use doesn't depend on len(t).
+    """
+    if path is not None and path.endswith((".npy", ".bin")):
+        if path.endswith(".npy"):
+            out = np.lib.format.open_memmap(path, mode="w+", dtype="<f8", shape=(len(t), 2))
+        else:
+            out = np.memmap(path, mode="w+", dtype="<f8", shape=(len(t), 2))
+        for start in range(0, len(t), chunk_size):
+            out[start:start+chunk_size, 0] = t[start:start+chunk_size]
+        evaluate_chunked(f, t, out[:, 1], chunk_size)
+        out.flush()
+        return
+
+    file = sys.stdout if path is None else open(path, "w")
+    if path is not None:
+        file.write("t,s\n")
+    for start in range(0, len(t), chunk_size):
+        chunk = np.asarray(t[start:start+chunk_size], dtype=float)
+        np.savetxt(file, np.column_stack([chunk, f(chunk)]), delimiter=",")
+    if path is not None:
+        file.close()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Fit a spline curve to points and evaluate it.")
+    parser.add_argument("points", help=f"CSV or .npy file with the x and y coordinates of the points, "
+                                       f"or a {EXTENSION} file with a saved spline")
+    parser.add_argument("-d", "--degree", type=int, default=3, choices=DEGREES, help="degree of the spline")
+    parser.add_argument("-k", "--knots", type=int,
+                        help="fit the spline in the least-squares sense on this many intervals between knots")
+    parser.add_argument("-s", "--smoothing", type=float, default=0.0,
+                        help="weight of the roughness penalty of the least-squares fit, 0 for none")
+    grid = parser.add_mutually_exclusive_group()
+    grid.add_argument("-n", "--samples", type=int, default=DEFAULT_samples,
+                      help="number of evenly spaced samples between the first and the last point")
+    grid.add_argument("--density", type=float, help="number of samples per unit of x")
+    grid.add_argument("-g", "--grid", help="CSV or .npy file with the points where the spline is evaluated")
+    parser.add_argument("-o", "--output",
+                        help="output file: .npy, .bin (raw little-endian float64) or CSV, standard output if omitted")
+    parser.add_argument("--save", help=f"write the fitted spline to this {EXTENSION} file")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_chunk,
+                        help="number of points evaluated at once, limits the memory use")
+    return parser, parser.parse_args(argv)
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    try:
+        if args.knots is not None and args.knots < 1:
+            raise ValueError("the number of knot intervals must be positive")
+        if args.samples < 1:
+            raise ValueError("the number of samples must be positive")
+        if args.density is not None and not args.density > 0:
+            raise ValueError("the density of the samples must be positive")
+        if args.chunk_size < 1:
+            raise ValueError("the chunk size must be positive")
+        if args.points.endswith(EXTENSION):     # already fitted
+            f = load_spline(args.points)
+            if f.c.ndim != 2:
+                raise ValueError(f"{args.points} contains a parametric curve, only splines y(x) can be evaluated")
+            xs = f.x
+        else:
+            xs, ys = read_points(args.points, unique=args.knots is None)
+            f = None
+        t = sample_grid(xs, args)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if f is None and args.knots is None:
+        f = spline(xs, ys, args.degree)
+    elif f is None:
+        f = least_squares_spline(xs, ys, args.degree, args.knots, args.smoothing)
+    if args.save is not None:
+        save_spline(args.save, f)
+    write_result(f, t, args.output, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Compact binary files of sessions (curves, view) and of fitted splines.
+
+A file starts with MAGIC, the length of a JSON header and the header itself. The header holds the metadata
+(degree, limits of the view...) and the dtype, shape and offset of every array. The arrays follow as contiguous
+little-endian data aligned to ALIGNMENT bytes, so they are memory-mapped when the file is loaded: opening a spline
+with 10^6 knots reads only the header, and evaluating it reads only the pages of the polynomials it needs.
+Only numpy is needed. Example:
+
+    save_spline("curve.spl", spline(x, y, 5))
+    f = load_spline("curve.spl")
+"""
+import os
+import json
+import tempfile
+import numpy as np
+from spline_functions import PiecewisePolynomial
+
+MAGIC = b"SPLINE\x00\x01"      # the last byte is the version of the format
+ALIGNMENT = 64                  # offsets of the arrays are multiples of this many bytes
+EXTENSION = ".spl"
+
+
+def write_arrays(path, arrays, meta):
+    """
+    Writes the dict of arrays 'arrays' and the JSON-serializable dict 'meta' to 'path'. The file is written next
+    to 'path' and then replaces it, so arrays memory-mapped from the old file (which may be among 'arrays')
+    stay valid.
+    """
+    arrays = {name: np.asarray(a) for name, a in arrays.items()}
+    arrays = {name: a.astype(a.dtype.newbyteorder("<"), copy=False) for name, a in arrays.items()}
+    layout, offset = {}, 0
+    for name, a in arrays.items():
+        layout[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset}
+        offset += -(-a.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({"meta": meta, "arrays": layout}).encode()
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT    # the arrays start here
+    fd, temporary = tempfile.mkstemp(suffix=EXTENSION, dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with open(fd, "wb") as file:
+            file.write(MAGIC)
+            file.write(np.uint64(len(header)).astype("<u8").tobytes())
+            file.write(header)
+            for name, a in arrays.items():
+                file.seek(start + layout[name]["offset"])
+                np.ascontiguousarray(a).tofile(file)
+            file.truncate(start + offset)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)    # the permissions open() gives, mkstemp makes it private
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def read_arrays(path, mmap=True):
+    """
+    Reads a file written by 'write_arrays' and returns (arrays, meta). If 'mmap' is True, the arrays are read-only
+    memory maps of the file, otherwise they are read into memory. Raises ValueError if it isn't such a file.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a spline file of this version")
+        length = int(np.frombuffer(file.read(8), dtype="<u8")[0])
+        header = json.loads(file.read(length))
+        start = -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+            count = int(np.prod(shape))
+            if mmap and count:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=start + spec["offset"], shape=shape)
+            else:
+                file.seek(start + spec["offset"])
+                arrays[name] = np.fromfile(file, dtype=dtype, count=count).reshape(shape)
+    return arrays, header["meta"]
+
+
+def spline_arrays(f):
+    """Returns the arrays and metadata of the 'PiecewisePolynomial' f for 'write_arrays'."""
+    return {"knots": f.x, "coefficients": f.c}, {"local": f.local}
+
+
+def save_spline(path, f):
+    """Writes the 'PiecewisePolynomial' f to 'path'."""
+    arrays, meta = spline_arrays(f)
+    write_arrays(path, arrays, dict(meta, kind="spline"))
+
+
+def load_spline(path, mmap=True):
+    """
+    Returns the 'PiecewisePolynomial' saved in 'path' by 'save_spline'.
+    Its knots and coefficients are memory-mapped unless 'mmap' is False.
+    """
+    arrays, meta = read_arrays(path, mmap)
+    if "coefficients" not in arrays:
+        raise ValueError(f"{path} doesn't contain a fitted spline")
+    return PiecewisePolynomial(arrays["knots"], arrays["coefficients"], meta["local"])
+
+
+def save_session(path, curves, xlim, ylim, parametric=False):
+    """
+    Writes the curves, the limits of the view and the mode of the GUI to 'path'. 'curves' is a list of dicts
+    with the points 'xs' and 'ys', the 'degree' and optionally the fitted spline 'polynomials' of every curve,
+    which is saved too, so it doesn't have to be fitted again.
+    """
+    arrays, saved = {}, []
+    for i, curve in enumerate(curves):
+        arrays[f"xs{i}"] = np.asarray(curve["xs"], dtype=float)
+        arrays[f"ys{i}"] = np.asarray(curve["ys"], dtype=float)
+        meta = {"degree": curve["degree"]}
+        if curve.get("polynomials") is not None:
+            spline_data, spline_meta = spline_arrays(curve["polynomials"])
+            arrays.update({f"{name}{i}": a for name, a in spline_data.items()})
+            meta.update(spline_meta)
+        saved.append(meta)
+    write_arrays(path, arrays, {"kind": "session", "curves": saved, "xlim": list(map(float, xlim)),
+                                "ylim": list(map(float, ylim)), "parametric": parametric})
+
+
+def load_session(path, mmap=True):
+    """
+    Reads a session saved by 'save_session'. Returns a dict with the keys of its arguments, the curves are dicts
+    with the keys 'xs', 'ys', 'degree' and 'polynomials' (None if no spline was saved).
+    Sessions with a single curve saved before several curves were supported are read as one curve.
+    """
+    arrays, meta = read_arrays(path, mmap)
+    if meta.get("kind") != "session":
+        raise ValueError(f"{path} is not a saved session")
+    if "curves" in meta:
+        curves = [session_curve(arrays, saved, str(i)) for i, saved in enumerate(meta["curves"])]
+    else:   # the single-curve layout, the curve is described by the top-level metadata
+        curves = [session_curve(arrays, meta, "")]
+    return {"curves": curves, "xlim": tuple(meta["xlim"]), "ylim": tuple(meta["ylim"]),
+            "parametric": meta["parametric"]}
+
+
+def session_curve(arrays, saved, suffix):
+    """Returns the curve whose arrays have names ending with 'suffix' and metadata 'saved' as a dict."""
+    polynomials = None
+    if "coefficients" + suffix in arrays:
+        polynomials = PiecewisePolynomial(arrays["knots" + suffix], arrays["coefficients" + suffix], saved["local"])
+    return {"xs": np.array(arrays["xs" + suffix]), "ys": np.array(arrays["ys" + suffix]), "degree": saved["degree"],
+            "polynomials": polynomials}
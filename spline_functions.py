@@ -1,50 +1,176 @@
+import threading
 import numpy as np
-from math import ceil
-from numpy.polynomial import polynomial as pl
+import profiling
+from hashlib import blake2b
+from collections import OrderedDict
+from functools import lru_cache
 
+MAX_cond_update = 1e8      # DragSession factorizes again if its low-rank update is worse conditioned
+DEFAULT_chunk = 2**20       # number of points evaluated at once by 'evaluate_chunked'
+DEFAULT_cache_bytes = 2**27  # memory limit of 'SplineCache' (128 MiB)
+CENTRIPETAL = 0.5           # exponent of the chord lengths in 'chord_parameters', 1 is the chord-length one
+NUM_probes = 4              # 'adaptive_samples' probes every polynomial of degree m at NUM_probes*m points
+DEFAULT_knots = 64          # number of knot intervals of 'least_squares_spline'
+MIN_smoothing = 1e-12       # ridge keeping the normal equations of 'least_squares_spline' regular
+ROOT_tol = 1e-12            # relative tolerance of 'PiecewisePolynomial.roots'
 
-def binary_search(a, n):
-    l = 0
-    r = len(a) - 1
-    while l != r:
-        m = ceil((l + r)/2)
-        if n < a[m]:
-            r = m-1
+
+class PiecewisePolynomial:
+    """
+    Spline function stored as an (n, m) array of coefficients of the n polynomials and the n+1 knots.
+
+    The i-th polynomial is defined on $[x_i, x_{i+1}]$ and its coefficients are ordered from the lowest power.
+    If 'local' is True, the polynomials are in powers of $u = (t - x_i)/h_i$ where $h_i = x_{i+1} - x_i$,
+    so u is in [0, 1] on every polynomial and the coefficients have the magnitude of the y values wherever
+    the knots are. Otherwise they are in powers of $t$ (only used by the reference solvers).
+    Points to the left of $x_0$ or to the right of $x_n$ are evaluated by the outermost polynomials.
+
+    Several splines on the same knots can be stacked into coefficients of shape (series, n, m).
+    They are all evaluated at once and the result then has the shape (series,) + t.shape.
+    """
+    def __init__(self, x, c, local=True):
+        self.x = np.asarray(x, dtype=float)     # knots
+        self.h = np.diff(self.x)                # lengths of the intervals
+        self.c = np.asarray(c, dtype=float)     # coefficients
+        self.local = local
+
+    def __len__(self):
+        return self.c.shape[-2]
+
+    def __call__(self, t):
+        """
+        Evaluates the spline at all points of 't' at once. 't' doesn't need to be sorted.
+        The result has the dtype of the coefficients, see 'astype'.
+        """
+        t = np.asarray(t, dtype=float)
+        i = self.segment(t)
+        c = self.c
+        if self.local:  # u is computed in float64, so that no digits of t - x_i are lost
+            s = ((t - self.x[i]) / self.h[i]).astype(c.dtype, copy=False)
         else:
-            l = m
-    return l
+            s = t
+        v = c[..., i, -1]
+        for k in range(c.shape[-1]-2, -1, -1):  # Horner's scheme for all points at once
+            v = v*s + c[..., i, k]
+        return v
+
+    def segment(self, t):
+        """Returns the indices of the polynomials used to evaluate the points of 't'."""
+        return np.clip(np.searchsorted(self.x, t, side="right") - 1, 0, len(self) - 1)
 
+    def derivative(self, order=1):
+        """Returns the order-th derivative as a 'PiecewisePolynomial' on the same knots."""
+        c = self.c
+        for _ in range(order):
+            if c.shape[-1] == 1:
+                c = np.zeros_like(c)
+                break
+            c = c[..., 1:] * np.arange(1, c.shape[-1])
+            if self.local:  # du/dt = 1/h_i
+                c = c / self.h[:, None]
+        return PiecewisePolynomial(self.x, c, self.local)
 
-def update_coords_add(xs, ys, xnew, ynew):
-    """Inserts 'xnew' to a sorted list 'xs' and keeps it sorted. Inserts 'ynew' to 'ys' accordingly."""
-    if len(xs) == 0:
-        ind = 0
-    else:
-        ind = binary_search(xs, xnew)
-        ind = ind if xnew < xs[0] else ind+1
-    xs.insert(ind, xnew)
-    ys.insert(ind, ynew)
+    def antiderivative(self):
+        """
+        Returns the antiderivative F with $F(x_0) = 0$ as a 'PiecewisePolynomial' on the same knots.
+        Its polynomials are the integrals of the polynomials of the spline, shifted by the cumulative sums of the
+        integrals over the previous intervals, so that F is continuous.
+        """
+        c = self.c
+        k = np.arange(1, c.shape[-1] + 1)
+        if self.local:  # dt = h_i du
+            c = c * self.h[:, None]
+        a = np.concatenate([np.zeros_like(c[..., :1]), c / k], axis=-1)    # a_0 = 0, a_k = c_{k-1} / k
+        if self.local:
+            ends = a.sum(axis=-1)   # F_i(x_{i+1}) - F_i(x_i) as u goes from 0 to 1
+        else:
+            powers = self.x[:, None] ** np.arange(a.shape[-1])
+            starts = (a * powers[:-1]).sum(axis=-1)
+            ends = (a * powers[1:]).sum(axis=-1) - starts
+            a[..., 0] = -starts
+        a[..., 0] += np.cumsum(ends, axis=-1) - ends    # the integral from x_0 to x_i
+        return PiecewisePolynomial(self.x, a, self.local)
 
+    def integrate(self, a, b):
+        """
+        Returns the definite integrals of the spline from 'a' to 'b' (numbers or arrays which broadcast together).
+        Ranges outside of the knots use the outermost polynomials, like the evaluation.
+        """
+        F = self.antiderivative()
+        return F(b) - F(a)
 
-def update_coords_del(xs, ys, xremove):
-    """Removes 'xremove' from a sorted list 'xs'. Removes the y value from 'ys' accordingly."""
-    ind = binary_search(xs, xremove)
-    del xs[ind]
-    del ys[ind]
+    def roots(self, level=0.0):
+        """
+        Returns the sorted points t where the spline f(t) = 'level' (the roots of f - level).
 
+        The roots of all polynomials are found at once as the eigenvalues of their stacked companion matrices
+        (grouped by the actual degree, so that vanishing leading coefficients don't matter), the real ones inside
+        their intervals are kept and refined by a Newton step. Roots on a knot are reported once.
+        Polynomials equal to 'level' on their whole interval have infinitely many roots and are skipped.
+        Only for a single series of coefficients.
+        """
+        if self.c.ndim != 2:
+            raise ValueError("roots can be found only for a single spline, not for stacked ones")
+        c = self.c.copy()
+        c[:, 0] -= level
+        n, k = c.shape
+        if self.local:
+            lo, hi = np.zeros(n), np.ones(n)
+        else:
+            lo, hi = self.x[:-1], self.x[1:]
+        scale = np.abs(c).max(axis=1)
+        significant = np.abs(c) > ROOT_tol * scale[:, None]
+        degree = np.where(significant.any(axis=1), k - 1 - np.argmax(significant[:, ::-1], axis=1), 0)
+        segments, points = [], []
+        for d in range(1, k):
+            i = np.flatnonzero(degree == d)
+            if len(i) == 0:
+                continue
+            monic = c[i, :d] / c[i, d:d+1]
+            companion = np.zeros((len(i), d, d))
+            companion[:, np.arange(1, d), np.arange(d-1)] = 1
+            companion[:, :, -1] = -monic
+            z = np.linalg.eigvals(companion)
+            width = (hi - lo)[i, None]
+            real = np.abs(z.imag) <= ROOT_tol**0.5 * width
+            s = z.real
+            inside = real & (s >= lo[i, None] - ROOT_tol * width) & (s <= hi[i, None] + ROOT_tol * width)
+            rows, cols = np.nonzero(inside)
+            segments.append(i[rows])
+            points.append(s[rows, cols])
+        if not segments:
+            return np.array([])
+        i, s = np.concatenate(segments), np.concatenate(points)
+        p, dp = c[i, -1], np.zeros_like(s)
+        for j in range(k-2, -1, -1):    # Horner's scheme for the values and the derivatives at once
+            dp = dp*s + p
+            p = p*s + c[i, j]
+        width = hi[i] - lo[i]
+        step = np.divide(p, dp, out=np.zeros_like(s), where=dp != 0)
+        step[np.abs(step) > ROOT_tol**0.5 * width] = 0     # near multiple roots Newton's method doesn't help
+        s = np.clip(s - step, lo[i], hi[i])
+        t = self.x[i] + s*self.h[i] if self.local else s
+        order = np.argsort(t)
+        t, i = t[order], i[order]
+        distinct = np.diff(t, prepend=-np.inf) > ROOT_tol**0.5 * self.h[i]
+        return t[distinct]
 
-def min_interval(a):
-    a = sorted(a)
-    min_diff = a[1] - a[0]
-    for i in range(1, len(a)):
-        if a[i] - a[i-1] < min_diff:
-            min_diff = a[i] - a[i-1]
-    return min_diff
+    def astype(self, dtype):
+        """
+        Returns the spline with coefficients of type 'dtype'. With np.float32 the evaluation is faster and
+        accurate to about 1e-7 relative to the y values, which is plenty for drawing (only for 'local' splines).
+        """
+        f = PiecewisePolynomial(self.x, [], self.local)
+        f.c = self.c.astype(dtype)
+        return f
 
 
-def natural_spline(x, y):
+def natural_spline_dense(x, y):
     """
-    Solves for the parameters of cubic functions that make up the spline function and returns them in a list.
+    Reference solver for the natural cubic spline, kept for cross-checking 'natural_spline'.
+
+    Solves for the parameters of cubic functions that make up the spline function and returns them as a
+    'PiecewisePolynomial'.
 
     The cubics are of the form $f_i = a_i*x^3 + b_i*x^2 + c_i*x + d_i$. They satisfy the following:
         - $f_0(x_0) = y_0,  f_{n-1}(x_n) = y_n$                              --> 2 equations
@@ -94,20 +220,180 @@ def natural_spline(x, y):
     matrix[4*n-1][-4:-2] = [6*x[n], 2]
 
     v = np.linalg.solve(matrix, b).reshape((n, 4))  # solve the SoLE and reshape the result
-    def f(i):
-        return lambda t: v[i][0]*t**3 + v[i][1]*t**2 + v[i][2]*t + v[i][3]
-    return [f(i) for i in range(n)]
+    return PiecewisePolynomial(x, v[:, ::-1], local=False)
+
+
+def thomas_factor(sub, diag, sup):
+    """
+    Forward elimination of the Thomas algorithm, which only depends on the matrix of a tridiagonal system.
+
+    'sub', 'diag' and 'sup' are the sub-diagonal, diagonal and super-diagonal of the matrix;
+    sub[0] and sup[-1] are ignored. The matrix is expected to be diagonally dominant, so no pivoting is done.
+    Returns the factorization used by 'thomas_solve'.
+    """
+    n = len(diag)
+    c = [0.0] * n       # python floats are much faster to work with than numpy scalars
+    beta = [0.0] * n
+    ci = 0.0
+    i = 0
+    sub, diag, sup = (np.asarray(a, dtype=float).tolist() for a in (sub, diag, sup))
+    for a, b, s in zip(sub, diag, sup):
+        bi = b - a * ci
+        ci = s / bi
+        c[i] = ci
+        beta[i] = bi
+        i += 1
+    return sub, c, beta
+
+
+def thomas_solve(factor, rhs):
+    """
+    Solves a tridiagonal system factorized by 'thomas_factor' in O(n) time and memory.
+
+    'rhs' may also be a 2D array, in which case the system is solved for all of its columns at once.
+    """
+    sub, c, beta = factor
+    n = len(beta)
+    rhs = np.asarray(rhs, dtype=float)
+    if rhs.ndim > 1:
+        d = rhs.copy()
+        for i in range(n):      # forward elimination
+            d[i] = (d[i] - sub[i] * d[i-1]) / beta[i] if i else d[i] / beta[i]
+        for i in range(n-2, -1, -1):    # back substitution
+            d[i] -= c[i] * d[i+1]
+        return d
+
+    d = [0.0] * n
+    di = 0.0
+    i = 0
+    for a, b, r in zip(sub, beta, rhs.tolist()):    # forward elimination
+        di = (r - a * di) / b
+        d[i] = di
+        i += 1
+    for i in range(n-2, -1, -1):    # back substitution
+        di = d[i] - c[i] * di
+        d[i] = di
+    return np.array(d)
+
+
+def thomas(sub, diag, sup, rhs):
+    """Solves a tridiagonal system using the Thomas algorithm in O(n) time and memory. See 'thomas_factor'."""
+    return thomas_solve(thomas_factor(sub, diag, sup), rhs)
 
 
-def spline(x, y, m):
+def natural_spline_matrix(x):
+    """Returns the sub-diagonal, diagonal and super-diagonal of the tridiagonal SoLE of 'natural_spline'."""
+    h = np.diff(np.asarray(x, dtype=float))
+    return h[:-1], 2*(h[:-1] + h[1:]), h[1:]
+
+
+def natural_spline_rhs(x, y):
+    """
+    Creates the right-hand side of the SoLE of 'natural_spline' for the points (x, y).
+    For 'y' of shape (series, n+1) it has a column for every series.
+    """
+    return 6*np.diff(np.diff(y) / np.diff(x)).T
+
+
+class NaturalSplineSystem:
+    """
+    Factorized SoLE of 'natural_spline' for the knots 'x'. It can be solved for any y values on these knots.
+
+    The unknowns are the moments $M_1, ... M_{n-1}$, see 'natural_spline'.
+    """
+    def __init__(self, x):
+        self.x = np.asarray(x, dtype=float)
+        self.size = len(self.x) - 2     # number of unknowns
+        with profiling.span("factorize"):
+            self.factor = thomas_factor(*natural_spline_matrix(self.x))
+
+    def rhs(self, x, y):
+        """Creates the right-hand side of the SoLE for the points (x, y), see 'natural_spline_rhs'."""
+        return natural_spline_rhs(x, y)
+
+    def solve(self, b):
+        profiling.count("solves")
+        with profiling.span("solve"):
+            return thomas_solve(self.factor, b)
+
+    def local_rows(self, x, j):
+        """
+        Returns the rows of the matrix for the knots 'x' that depend on $x_j$ as (rows, col, matrix).
+
+        'rows' are the indices of the rows and 'matrix' holds their entries in the columns col, col+1, ...
+        """
+        n = len(x) - 1
+        rows = np.arange(max(0, j-2), min(n-1, j+1))
+        if len(rows) == 0:
+            return rows, 0, np.zeros((0, 0))
+        col = max(0, rows[0] - 1)
+        h = np.diff(x)
+        matrix = np.zeros((len(rows), min(n-1, rows[-1] + 2) - col))
+        for r, row in enumerate(rows):  # row 'row' is the equation for $M_{row+1}$
+            if row > 0:
+                matrix[r, row-1-col] = h[row]
+            matrix[r, row-col] = 2*(h[row] + h[row+1])
+            if row < n-2:
+                matrix[r, row+1-col] = h[row+1]
+        return rows, col, matrix
+
+    def spline(self, x, y, moments):
+        """Creates the cubic functions from the points (x, y) and the solution 'moments' of the SoLE."""
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        n = len(x) - 1
+        h = np.diff(x)
+        slope = np.diff(y) / h
+        M = np.zeros(y.shape)   # moments, M_0 = M_n = 0
+        M[..., 1:n] = np.asarray(moments).T
+
+        v = np.empty(y.shape[:-1] + (n, 4))
+        v[..., 0] = y[..., :-1]
+        v[..., 1] = slope - h*(2*M[..., :-1] + M[..., 1:]) / 6
+        v[..., 2] = M[..., :-1] / 2
+        v[..., 3] = (M[..., 1:] - M[..., :-1]) / (6*h)
+        return PiecewisePolynomial(x, v * powers(h, 3))    # powers of (t - x_i) --> powers of (t - x_i)/h_i
+
+    def fit(self, y):
+        """
+        Returns the natural spline through the points (x, y) as a 'PiecewisePolynomial'.
+        'y' of shape (series, n+1) gives all the splines stacked, see 'spline_batch'.
+        """
+        return self.spline(self.x, y, self.solve(self.rhs(self.x, y)))
+
+
+def natural_spline(x, y, dense=False):
     """
+    Solves for the cubic functions that make up the natural spline function and returns them as a
+    'PiecewisePolynomial'.
+
+    Instead of the 4n x 4n system used by 'natural_spline_dense' we solve for the second derivatives
+    (moments) $M_i = f''(x_i)$. Natural end conditions give $M_0 = M_n = 0$ and continuity of the first
+    derivative gives for $1 <= i <= n-1$:
+        $h_{i-1}M_{i-1} + 2(h_{i-1} + h_i)M_i + h_iM_{i+1} = 6((y_{i+1} - y_i)/h_i - (y_i - y_{i-1})/h_{i-1})$,
+    where $h_i = x_{i+1} - x_i$. This is a diagonally dominant tridiagonal system solved in O(n) by 'thomas'.
+
+    The cubics are then of the form $f_i = a_i(x - x_i)^3 + b_i(x - x_i)^2 + c_i(x - x_i) + d_i$ with
+        $a_i = (M_{i+1} - M_i)/(6h_i)$, $b_i = M_i/2$, $c_i = (y_{i+1} - y_i)/h_i - h_i(2M_i + M_{i+1})/6$, $d_i = y_i$.
+
+    If 'dense' is True, the reference solver 'natural_spline_dense' is used instead.
+    """
+    if dense:
+        return natural_spline_dense(x, y)
+    return NaturalSplineSystem(x).fit(y)
+
+
+def spline_dense(x, y, m):
+    """
+    Reference solver for 'spline' which solves the whole (m+1)n x (m+1)n system with a dense matrix.
+
     m is the degree of polynomials
     f_i = a_im * x^m + a_i{m-1} * x^{m-1} + ... + a_i1 * x + ai0
     The vector of unknowns will be of the form:
     $(a_00, a_01,... a_0m,... a_{n-1}0, a_{n-1}1, ...a_{n-1}m)$.
     """
+    from numpy.polynomial import polynomial as pl     # only needed by this reference solver
     if m == 3:
-        return natural_spline(x, y)
+        return natural_spline(x, y, dense=True)
     n = len(x) - 1  # number of polynomials
     m = m + 1   # m := number of coefficients of polynomials
     # if m % 2 == 0:  # don't allow even m (asymmetric final conditions)
@@ -145,6 +431,630 @@ def spline(x, y, m):
             fder += 1
 
     v = np.linalg.solve(matrix, b).reshape((n, m))  # solve the SoLE and reshape the result
-    def f(i):
-        return lambda t: pl.polyval(t, v[i])
-    return [f(i) for i in range(n)]
+    return PiecewisePolynomial(x, v, local=False)
+
+
+def boundary_conditions(m):
+    """
+    Returns the derivative orders set to zero in the left-most and in the right-most point for degree 'm'.
+
+    The second derivative is set to zero in both end points first, then the third and so on, left point first.
+    For even degrees the first derivative in the left-most point is set to zero as the last condition.
+    """
+    left, right = [], []
+    fder = 2
+    for der in range(1, m):
+        if der == m - 1 and m % 2 == 0:
+            left.append(1)
+        elif der % 2 == 1:
+            left.append(fder)
+        else:
+            right.append(fder)
+            fder += 1
+    return left, right
+
+
+def powers(t, m):
+    """Returns the matrix of $t^0, t^1, ... t^m$ for every element of the vector 't' computed by cumulative products."""
+    p = np.empty((len(t), m+1))
+    p[:, 0] = 1
+    p[:, 1:] = t[:, None]
+    return np.cumprod(p, axis=1, out=p)
+
+
+@lru_cache(maxsize=None)
+def binomial_table(m):
+    """
+    Returns the table of binomial coefficients binomial[d, k] = (k choose d) for $0 <= d, k <= m$.
+
+    The d-th derivative of $a_0 + a_1u + ... + a_mu^m$ at u = 1 divided by d! is $\\sum_k$ binomial[d, k] * a_k.
+    """
+    k = np.arange(m+1)
+    binomial = np.ones((m+1, m+1))
+    for d in range(1, m+1):     # (k choose d) = (k choose d-1) * (k-d+1) / d, zero for k < d
+        binomial[d] = binomial[d-1] * np.maximum(k - d + 1, 0) / d
+    binomial.flags.writeable = False    # shared by all callers
+    return binomial
+
+
+def spline_blocks(x, m):
+    """
+    Creates the SoLE of 'spline' grouped by segments, so that every group only couples two adjacent polynomials.
+
+    The unknowns are the coefficients of the polynomials in the scaled local basis $u = (t - x_i)/h_i$ (see
+    'PiecewisePolynomial'), so $f_i(x_i) = a_i0$, $f_i(x_{i+1}) = \\sum_k a_ik$ and the d-th derivative in $x_{i+1}$
+    is $\\sum_k$ binomial[d, k] * a_ik * d!/h_i^d. The entries depend only on the ratios of adjacent $h_i$ instead of
+    powers of the knots, which keeps the SoLE well-conditioned for high degrees and knots far from the origin.
+
+    Returns (first, blocks, last) where
+        - first (L+2 rows) acts on $f_0$: the L conditions in $x_0$, $f_0(x_0) = y_0$ and $f_0(x_1) = y_1$,
+        - blocks[i-1] (m+1 rows) acts on $f_{i-1}, f_i$ for $1 <= i <= n-1$: the continuity of the derivatives
+          1 to m-1 in $x_i$, $f_i(x_i) = y_i$ and $f_i(x_{i+1}) = y_{i+1}$,
+        - last (R rows) acts on $f_{n-1}$: the R conditions in $x_n$.
+    L and R are the numbers of conditions in the end points given by 'boundary_conditions'.
+    'blocks' is an array of shape (n-1, m+1, 2(m+1)), it is built for all knots at once.
+    """
+    return spline_first(x, m), spline_group_rows(x, 1, len(x)-1, m), spline_last(x, m)
+
+
+def spline_group_rows(x, start, stop, m):
+    """
+    Returns the groups start, ... stop-1 of the SoLE given by 'spline_blocks' as an array, $1 <= i <= n-1$.
+
+    The continuity of the d-th derivative in $x_i$ is multiplied by $(h_{i-1}h_i)^{d/2}/d!$, so that it reads
+    $\\sum_k$ binomial[d, k] * r^d * a_{i-1}k - a_id / r^d = 0 with $r = \\sqrt{h_i/h_{i-1}}$.
+    """
+    h = np.diff(np.asarray(x, dtype=float))
+    k = max(stop - start, 0)
+    r = np.sqrt(h[start:stop] / h[start-1:stop-1])
+    scale = powers(r, m-1)[:, 1:]   # r^d for d = 1, ... m-1
+    blocks = np.zeros((k, m+1, 2*(m+1)))
+    blocks[:, :m-1, :m+1] = binomial_table(m)[1:m] * scale[:, :, None]
+    d = np.arange(1, m)
+    blocks[:, d-1, m+1+d] = -1 / scale
+    blocks[:, m-1, m+1] = 1
+    blocks[:, m, m+1:] = 1
+    return blocks
+
+
+def spline_first(x, m):
+    """Returns the first group of rows of the SoLE given by 'spline_blocks'."""
+    left, right = boundary_conditions(m)
+    first = np.zeros((len(left) + 2, m+1))
+    first[np.arange(len(left)), left] = 1     # the der-th derivative in $x_0$ is a_0der * der!/h_0^der
+    first[len(left), 0] = 1
+    first[len(left) + 1] = 1
+    return first
+
+
+def spline_block(x, i, m):
+    """Returns the i-th group of rows of the SoLE given by 'spline_blocks' for $1 <= i <= n-1$."""
+    return spline_group_rows(x, i, i+1, m)[0]
+
+
+def spline_last(x, m):
+    """Returns the last group of rows of the SoLE given by 'spline_blocks'."""
+    left, right = boundary_conditions(m)
+    return binomial_table(m)[right].reshape((len(right), m+1))
+
+
+def spline_rhs(y, m):
+    """
+    Creates the right-hand side of the SoLE given by 'spline_blocks' as a vector ordered by the groups.
+    For 'y' of shape (series, n+1) it has a column for every series.
+    """
+    y = np.asarray(y, dtype=float).T
+    n = len(y) - 1
+    series = y.shape[1:]
+    left, right = boundary_conditions(m)
+    b = np.zeros((n-1, m+1) + series)    # groups of 'blocks'
+    b[:, m-1] = y[1:n]
+    b[:, m] = y[2:]
+    return np.concatenate([np.zeros((len(left),) + series), y[:2], b.reshape((-1,) + series),
+                           np.zeros((len(right),) + series)])
+
+
+class BlockBandedSolver:
+    """
+    Factorizes the block-banded SoLE given by 'spline_blocks' and solves it for any right-hand side.
+
+    The groups are eliminated from left to right with a QR decomposition of each block column.
+    The rows that are left over after eliminating $f_{i-1}$ (as many as there are rows in 'first') only act on
+    $f_i$ and are carried over to the next group. The carried rows together with 'last' form the final square block.
+    Only the small orthogonal and triangular factors of every group are stored, so memory is O(n m^2)
+    and time is O(n m^3) instead of O(n^2 m^2) and O(n^3 m^3) for the dense matrix.
+    The inverses of the triangular factors are multiplied into the stored factors, so apart from the final block
+    solving is only matrix-vector products, O(n m^2) for every right-hand side.
+    """
+    def __init__(self, first, blocks, last):
+        self.k = first.shape[1]      # number of coefficients of polynomials
+        self.n = len(blocks) + 1     # number of polynomials
+        self.q = []                  # transposed orthogonal factors of the groups, the first k rows times $R^{-1}$
+        self.s = []                  # transformed coupling to $f_i$ times $R^{-1}$
+        k = self.k
+        carry = first
+        for block in blocks:
+            stacked = np.vstack([np.hstack([carry, np.zeros_like(carry)]), block])
+            q, r = np.linalg.qr(stacked[:, :k], mode="complete")
+            q = q.T
+            t = q @ stacked[:, k:]
+            r_inv = np.linalg.inv(r[:k])    # of the triangular factor acting on $f_{i-1}$
+            q[:k] = r_inv @ q[:k]
+            self.q.append(q)
+            self.s.append(r_inv @ t[:k])
+            carry = t[k:]
+        self.final = np.vstack([carry, last])
+        self.first_rows = len(first)
+
+    def solve(self, b):
+        """Solves the SoLE for 'b' ordered as in 'spline_rhs' and returns the coefficients ordered by polynomials."""
+        b = np.asarray(b, dtype=float)
+        k, n = self.k, self.n
+        carry = b[:self.first_rows]
+        d = []
+        for i in range(n-1):    # forward elimination
+            start = self.first_rows + i*k
+            z = self.q[i] @ np.concatenate([carry, b[start:start+k]])
+            d.append(z[:k])
+            carry = z[k:]
+        v = np.empty((n, k) + b.shape[1:])
+        v[n-1] = np.linalg.solve(self.final, np.concatenate([carry, b[self.first_rows + (n-1)*k:]]))
+        for i in range(n-2, -1, -1):    # back substitution
+            v[i] = d[i] - self.s[i] @ v[i+1]
+        return v.reshape((n*k,) + b.shape[1:])
+
+
+class SplineSystem:
+    """
+    Factorized SoLE of 'spline' for the knots 'x' and degree 'm'. It can be solved for any y values on these knots.
+
+    The unknowns are the coefficients of the polynomials, see 'spline_dense'.
+    """
+    def __init__(self, x, m):
+        self.x = np.asarray(x, dtype=float)
+        self.m = m
+        self.size = (m+1) * (len(x)-1)     # number of unknowns
+        with profiling.span("assemble"):
+            blocks = spline_blocks(self.x, m)
+        with profiling.span("factorize"):
+            self.solver = BlockBandedSolver(*blocks)
+
+    def rhs(self, x, y):
+        """Creates the right-hand side of the SoLE for the points (x, y)."""
+        return spline_rhs(y, self.m)
+
+    def solve(self, b):
+        profiling.count("solves")
+        with profiling.span("solve"):
+            return self.solver.solve(b)
+
+    def local_rows(self, x, j):
+        """
+        Returns the rows of the matrix for the knots 'x' that depend on $x_j$ as (rows, col, matrix).
+
+        'rows' are the indices of the rows and 'matrix' holds their entries in the columns col, col+1, ...
+        """
+        n, k = len(x) - 1, self.m + 1
+        first_rows = self.solver.first_rows
+        groups = []     # (first row, first column, rows of the group)
+        # $x_j$ changes $h_{j-1}$ and $h_j$, so only the groups j-1, j and j+1 (the first and last don't depend on x)
+        for i in range(max(1, j-1), min(n, j+2)):
+            groups.append((first_rows + (i-1)*k, (i-1)*k, spline_block(x, i, self.m)))
+        if not groups:
+            return np.arange(0), 0, np.zeros((0, 0))
+
+        col = min(g[1] for g in groups)
+        matrix = np.zeros((sum(len(g[2]) for g in groups), max(g[1] + g[2].shape[1] for g in groups) - col))
+        rows = []
+        r = 0
+        for row, c, block in groups:
+            matrix[r:r+len(block), c-col:c-col+block.shape[1]] = block
+            rows.extend(range(row, row + len(block)))
+            r += len(block)
+        return np.array(rows), col, matrix
+
+    def spline(self, x, y, v):
+        """Creates the polynomials from the points (x, y) and the solution 'v' of the SoLE."""
+        v = np.moveaxis(v, 0, -1)   # the series go first
+        return PiecewisePolynomial(x, v.reshape(v.shape[:-1] + (len(x)-1, self.m+1)))
+
+    def fit(self, y):
+        """
+        Returns the spline through the points (x, y) as a 'PiecewisePolynomial'.
+        'y' of shape (series, n+1) gives all the splines stacked, see 'spline_batch'.
+        """
+        return self.spline(self.x, y, self.solve(self.rhs(self.x, y)))
+
+
+def spline_system(x, m):
+    """Returns the factorized SoLE of the spline of degree 'm' on the knots 'x'."""
+    if m == 3:
+        return NaturalSplineSystem(x)
+    return SplineSystem(x, m)
+
+
+class DragSession:
+    """
+    Re-solves the spline while the j-th point is being moved, without factorizing the SoLE again.
+
+    Moving $y_j$ only changes the right-hand side. Moving $x_j$ (between its neighbours) only changes the few
+    rows returned by 'local_rows', so the new matrix is $A + UD$ where $U$ selects these rows and $D$ holds
+    their change. The solution is updated with the Sherman-Morrison-Woodbury formula
+        $(A + UD)^{-1}b = w - Z(I + DZ)^{-1}Dw$, where $w = A^{-1}b$ and $Z = A^{-1}U$,
+    so every move costs one solve with the factorization created when the dragging started.
+    The SoLE is factorized on the first move, so creating a session is cheap. If a 'SplineCache' is given,
+    the factorization is looked up in it first.
+    """
+    def __init__(self, x, y, m, j, cache=None):
+        self.x = np.array(x, dtype=float)
+        self.y = np.array(y, dtype=float)
+        self.m = m
+        self.j = j
+        self.cache = cache
+        self.system = None
+
+    def factorize(self):
+        """Factorizes the SoLE for the current points and prepares the update of the rows depending on $x_j$."""
+        if self.cache is None:
+            self.system = spline_system(self.x, self.m)
+        else:
+            self.system = self.cache.system(self.x, self.m)
+        self.rows, self.col, self.matrix = self.system.local_rows(self.x, self.j)
+        u = np.zeros((self.system.size, len(self.rows)))
+        u[self.rows, np.arange(len(self.rows))] = 1
+        self.z = self.system.solve(u)
+
+    def move(self, xj, yj):
+        """Moves the j-th point to (xj, yj) and returns the new spline as a 'PiecewisePolynomial'."""
+        if self.system is None:
+            self.factorize()
+        self.x[self.j] = xj
+        self.y[self.j] = yj
+        w = self.system.solve(self.system.rhs(self.x, self.y))
+        if len(self.rows):
+            d = self.system.local_rows(self.x, self.j)[2] - self.matrix
+            cols = slice(self.col, self.col + d.shape[1])
+            capacitance = np.eye(len(self.rows)) + d @ self.z[cols]
+            if np.linalg.cond(capacitance) > MAX_cond_update:   # the update would be inaccurate
+                self.factorize()
+                return self.system.fit(self.y)
+            w = w - self.z @ np.linalg.solve(capacitance, d @ w[cols])
+        return self.system.spline(self.x, self.y, w)
+
+
+def spline(x, y, m, dense=False):
+    """
+    Solves for the polynomials of degree m that make up the spline function and returns them as a
+    'PiecewisePolynomial'.
+
+    f_i = a_im * u^m + a_i{m-1} * u^{m-1} + ... + a_i1 * u + ai0 where u = (x - x_i)/h_i
+    The conditions are the same as in 'spline_dense', but the SoLE is ordered by segments ('spline_blocks')
+    which makes it block-banded, and it is solved by 'BlockBandedSolver' without allocating the dense matrix.
+    The local basis keeps it accurate for high degrees and for knots far from the origin.
+    Cubic splines are solved by 'natural_spline'.
+
+    If 'dense' is True, the reference solver 'spline_dense' is used instead.
+    """
+    if dense:
+        return spline_dense(x, y, m)
+    return spline_system(x, m).fit(y)
+
+
+def spline_batch(x, y, m):
+    """
+    Fits splines of degree m to many series of y values sampled on the same knots 'x'.
+
+    'y' has the shape (series, n+1). The SoLE is factorized only once and solved for all the series together.
+    Returns a 'PiecewisePolynomial' with coefficients of shape (series, n, m+1), which evaluates all the series
+    at once and returns an array of shape (series,) + t.shape.
+    """
+    y = np.asarray(y, dtype=float)
+    if y.ndim != 2 or y.shape[1] != len(x):
+        raise ValueError(f"y must have the shape (series, {len(x)}), got {y.shape}")
+    return spline_system(x, m).fit(y)
+
+
+def chord_parameters(xs, ys, alpha=CENTRIPETAL):
+    """
+    Returns the parameters $t_0 = 0 < t_1 < ... < t_n$ of the points (xs, ys) of a parametric curve,
+    $t_{i+1} - t_i = |P_{i+1} - P_i|^alpha$. alpha = 1 gives the chord-length parameterisation,
+    alpha = 0.5 the centripetal one which doesn't overshoot near sharp turns.
+    Raises ValueError if two consecutive points are the same.
+    """
+    h = np.hypot(np.diff(xs), np.diff(ys)) ** alpha
+    if np.any(h == 0):
+        raise ValueError("consecutive points of a parametric curve must differ")
+    return np.concatenate([[0], np.cumsum(h)])
+
+
+def parametric_spline(xs, ys, m, alpha=CENTRIPETAL):
+    """
+    Fits the parametric spline curve (x(t), y(t)) of degree m through the points (xs, ys) in the given order.
+    The points can repeat (closed curves) and the curve can intersect itself.
+
+    x(t) and y(t) are splines on the same knots 'chord_parameters', so the SoLE is factorized once and solved for
+    both as two right-hand sides. Returns a 'PiecewisePolynomial' f with f(t) of shape (2,) + t.shape.
+    """
+    return spline_batch(chord_parameters(xs, ys, alpha), np.vstack([xs, ys]), m)
+
+
+def quantile_knots(x, count):
+    """
+    Returns at most count+1 distinct knots from min(x) to max(x) placed at the quantiles of 'x',
+    so that every interval between them holds about the same number of points.
+    """
+    return np.unique(np.quantile(x, np.linspace(0, 1, count+1)))
+
+
+def bspline_basis(knots, t, i, m):
+    """
+    Returns the values at the points 't' of the m+1 B-splines of degree m that are nonzero on the i-th interval
+    of 'knots' (i can be an array, one interval per point) as an array of shape (m+1, len(t)).
+    The B-splines are defined on 'knots' with both ends repeated m+1 times, the r-th row is the (i+r)-th one.
+    Cox-de Boor recursion for all points at once; outside the interval it evaluates its polynomials.
+    """
+    e = np.concatenate([np.full(m, knots[0]), knots, np.full(m, knots[-1])])
+    s = np.asarray(i) + m   # e[s] <= t < e[s+1]
+    right = [e[s+k] - t for k in range(1, m+1)]     # right[k-1] = e[s+k] - t
+    left = [t - e[s+1-k] for k in range(1, m+1)]    # left[k-1] = t - e[s+1-k]
+    b = np.zeros((m+1, len(t)))
+    b[0] = 1
+    for j in range(1, m+1):
+        saved = np.zeros(len(t))
+        for r in range(j):
+            temp = b[r] / (right[r] + left[j-r-1])
+            b[r] = saved + right[r]*temp
+            saved = left[j-r-1]*temp
+        b[j] = saved
+    return b
+
+
+def solve_banded_spd(band, b):
+    """
+    Solves the symmetric positive definite SoLE with the matrix A given by its upper band, band[d, j] = A[j, j+d].
+    The matrix is split into square blocks as wide as the band, which makes it block-tridiagonal, and solved by
+    the block Cholesky decomposition in O(n w^2) time and memory for the width w.
+    """
+    w, n = band.shape
+    nb = -(-n // w)             # number of blocks
+    diag = np.zeros((nb, w, w))
+    upper = np.zeros((nb, w, w))
+    diag[-1] = np.eye(w)        # the padding after the last unknown
+    for d in range(w):
+        j = np.arange(n - d)
+        k = j + d
+        same = j // w == k // w
+        diag[j[same] // w, j[same] % w, k[same] % w] = band[d, j[same]]
+        diag[j[same] // w, k[same] % w, j[same] % w] = band[d, j[same]]
+        upper[j[~same] // w, j[~same] % w, k[~same] % w] = band[d, j[~same]]
+    rhs = np.zeros(nb * w)
+    rhs[:n] = b
+    rhs = rhs.reshape(nb, w)
+
+    lower = []      # Cholesky factors of the diagonal blocks
+    coupling = []   # L_{k+1,k}^T = L_k^{-1} A_{k,k+1}
+    z = np.empty_like(rhs)
+    for k in range(nb):     # factorization and forward substitution
+        a, r = diag[k], rhs[k]
+        if k:
+            a = a - coupling[-1].T @ coupling[-1]
+            r = r - coupling[-1].T @ z[k-1]
+        lower.append(np.linalg.cholesky(a))
+        z[k] = np.linalg.solve(lower[k], r)
+        coupling.append(np.linalg.solve(lower[k], upper[k]))
+    v = np.empty_like(rhs)
+    for k in range(nb-1, -1, -1):   # back substitution
+        r = z[k] if k == nb-1 else z[k] - coupling[k] @ v[k+1]
+        v[k] = np.linalg.solve(lower[k].T, r)
+    return v.reshape(-1)[:n]
+
+
+def least_squares_spline(x, y, m, knots=DEFAULT_knots, smoothing=0.0):
+    """
+    Fits a spline of degree m to the points (x, y) in the least-squares sense and returns it as a
+    'PiecewisePolynomial' on 'knots', which are usually far fewer than the points.
+
+    'knots' is either the number of intervals (the knots are then placed at the quantiles of x, see
+    'quantile_knots') or the sorted knots themselves. The spline has m-1 continuous derivatives like the
+    interpolating one; it is written as a combination of the n+m B-splines on the knots and their coefficients
+    minimize $\\sum (f(x_i) - y_i)^2 + \\lambda \\sum (\\Delta^2 c_k)^2$ (a P-spline). The second differences of the
+    coefficients penalize the roughness; 'smoothing' is $\\lambda$ relative to the mean diagonal of the normal
+    equations, so 0 is the plain least-squares fit and larger values give smoother curves. The normal equations
+    are banded, so fitting takes O(N m^2 + n m^2) time for N points and n knots. The points can repeat
+    and don't need to be sorted.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if np.ndim(knots) == 0:
+        knots = quantile_knots(x, knots)
+    knots = np.asarray(knots, dtype=float)
+    if len(knots) < 2:
+        raise ValueError("at least two distinct knots are needed")
+    n = len(knots) - 1
+    size = n + m    # number of B-splines
+    with profiling.span("assemble"):
+        i = np.clip(np.searchsorted(knots, x, side="right") - 1, 0, n-1)
+        b = bspline_basis(knots, x, i, m)
+        band = np.zeros((m+1, size))    # normal equations, band[d, j] = G[j, j+d]
+        rhs = np.zeros(size)
+        for r in range(m+1):
+            rhs += np.bincount(i + r, b[r] * y, minlength=size)
+            for q in range(r, m+1):
+                band[q-r] += np.bincount(i + r, b[r] * b[q], minlength=size)
+        scale = band[0].mean() if band[0].any() else 1.0
+        band[0] += MIN_smoothing * scale    # keeps the B-splines without points determined
+        if smoothing > 0 and size > 2:
+            k = np.arange(size - 2)
+            weights = (1, -2, 1)    # the second difference $c_k - 2c_{k+1} + c_{k+2}$
+            for r in range(3):
+                for q in range(r, 3):
+                    band[q-r, k+r] += smoothing * scale * weights[r] * weights[q]
+    with profiling.span("solve"):
+        coefficients = solve_banded_spd(band, rhs)
+    return bspline_polynomials(knots, coefficients, m)
+
+
+def bspline_polynomials(knots, coefficients, m):
+    """
+    Converts the spline $\\sum c_k B_k$ of degree m on 'knots' to a 'PiecewisePolynomial' in the local basis.
+    Every polynomial is interpolated at m+1 Chebyshev points of its interval, the Vandermonde matrix in u is
+    the same for all of them.
+    """
+    n = len(knots) - 1
+    u = (1 - np.cos(np.pi * np.arange(m+1) / m)) / 2
+    i = np.repeat(np.arange(n), m+1)
+    t = knots[i] + np.tile(u, n) * np.repeat(np.diff(knots), m+1)
+    b = bspline_basis(knots, t, i, m)
+    values = np.einsum("rp,rp->p", b, coefficients[np.arange(m+1)[:, None] + i]).reshape(n, m+1)
+    vandermonde = u[:, None] ** np.arange(m+1)
+    return PiecewisePolynomial(knots, np.linalg.solve(vandermonde, values.T).T)
+
+
+def array_key(a):
+    """Returns a short hash of the values of the array 'a', used to recognize the same knots or y values."""
+    a = np.ascontiguousarray(a, dtype=float)
+    return blake2b(a.tobytes(), digest_size=16, person=str(a.shape).encode()[:16]).digest()
+
+
+def nbytes(obj):
+    """Estimates the memory used by the arrays and numbers in 'obj' (and in its attributes, lists and tuples)."""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(o) for o in obj)
+    if isinstance(obj, (float, int)):
+        return 8
+    if hasattr(obj, "__dict__"):
+        return sum(nbytes(v) for v in vars(obj).values())
+    return 0
+
+
+class SplineCache:
+    """
+    Least recently used cache of factorized SoLEs (keyed by the knots and degree) and of the splines solved
+    with them (keyed by the knots, y values and degree).
+
+    Solving the same points again (after zooming, changing the lims, moving the degree slider back...) only costs
+    a lookup, and a new 'y' on cached knots only costs a solve with the cached factorization. The memory used by
+    the entries is estimated by 'nbytes'; the least recently used entries are evicted when it exceeds 'max_bytes'.
+
+    The cache can be shared by several threads. Only the lookups and updates are locked, the SoLEs are solved
+    outside the lock, so two threads missing the same key at once both solve it.
+    """
+    def __init__(self, max_bytes=DEFAULT_cache_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0                 # memory used by the entries
+        self.entries = OrderedDict()    # key -> (value, size), the least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def system(self, x, m):
+        """Returns the factorized SoLE of the spline of degree 'm' on the knots 'x', see 'spline_system'."""
+        key = ("system", array_key(x), m)
+        system = self.get(key)
+        if system is None:
+            system = spline_system(np.array(x, dtype=float), m)     # a copy, 'x' may change later
+            self.put(key, system)
+        return system
+
+    def spline(self, x, y, m):
+        """Returns the same 'PiecewisePolynomial' as 'spline', solved at most once for the same points and degree."""
+        key = self.spline_key(x, y, m)
+        f = self.get(key)
+        if f is None:
+            f = self.system(x, m).fit(np.array(y, dtype=float))
+            self.put(key, f)
+        return f
+
+    def spline_key(self, x, y, m):
+        return ("spline", array_key(x), array_key(y), m)
+
+    def get(self, key):
+        """Returns the value stored under 'key' and marks it as recently used, None if there is no such entry."""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value):
+        """Stores 'value' under 'key' and evicts the least recently used entries if the memory limit is exceeded."""
+        size = nbytes(value)
+        if size > self.max_bytes:   # it would evict everything else
+            return
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+def evaluate_stream(f, chunks):
+    """Evaluates the spline 'f' for every chunk of points from the iterable 'chunks' and yields the results."""
+    for chunk in chunks:
+        yield f(np.asarray(chunk, dtype=float))
+
+
+def evaluate_chunked(f, queries, out=None, chunk_size=DEFAULT_chunk):
+    """
+    Evaluates the spline 'f' at all 'queries' chunk by chunk and writes the results to 'out'.
+
+    'queries' and 'out' can be memory-mapped arrays (np.memmap, np.load(..., mmap_mode="r")), so only one chunk
+    of them is in memory at a time. The queries are neither sorted nor copied as a whole.
+    If 'out' is None, a new array is allocated. For stacked splines 'out' has the shape (series, len(queries)).
+    Returns 'out'.
+    """
+    if out is None:
+        out = np.empty(np.shape(f.c)[:-2] + (len(queries),))
+    for start in range(0, len(queries), chunk_size):
+        out[..., start:start+chunk_size] = f(np.asarray(queries[start:start+chunk_size], dtype=float))
+    return out
+
+
+def adaptive_samples(f, xmin, xmax, yscale, tol=0.5, max_samples=None):
+    """
+    Returns sorted points in [xmin, xmax] (and within the knots of 'f') where the spline 'f' should be evaluated,
+    so that the polyline through them is at most 'tol' pixels away from the curve. 'yscale' is the number
+    of pixels per unit of y. For stacked splines (see 'spline_batch') 'yscale' can give the scale of every series,
+    the error is then bounded for the vector of all of them, e.g. the point (x(t), y(t)) of 'parametric_spline'
+    with yscale = (xscale, yscale).
+
+    Between two samples at distance d the polyline differs from the curve by at most $d^2K/8$, where K is the
+    maximum of |f''|. K is estimated for every polynomial from f'' at a few probe points, so every polynomial gets
+    as many evenly spaced samples as it needs: flat parts get few and tight wiggles get many. The knots are always
+    included. If there would be more than 'max_samples' points, all polynomials get proportionally fewer.
+    """
+    x = f.x
+    xmin, xmax = max(xmin, x[0]), min(xmax, x[-1])
+    if xmin >= xmax:
+        return np.array([])
+    seg = np.arange(f.segment(xmin), np.clip(np.searchsorted(x, xmax) - 1, 0, len(f) - 1) + 1)
+    lo, hi = np.maximum(x[seg], xmin), np.minimum(x[seg+1], xmax)
+
+    probes = lo[:, None] + (hi - lo)[:, None] * np.linspace(0, 1, NUM_probes*f.c.shape[-1] + 1)
+    K = np.abs(f.derivative(2)(probes)).max(axis=-1) * np.reshape(yscale, np.shape(yscale) + (1,))   # in pixels
+    if K.ndim > 1:  # the norm of the vector of all series
+        K = np.sqrt((K**2).reshape((-1, len(seg))).sum(axis=0))
+    num = np.maximum(1, np.ceil((hi - lo) * np.sqrt(K / (8*tol)))).astype(int)
+    if max_samples is not None and num.sum() > max_samples:
+        num = np.maximum(1, (num * (max_samples / num.sum())).astype(int))
+
+    offsets = np.cumsum(num) - num
+    j = np.arange(num.sum()) - np.repeat(offsets, num)     # index of the sample within its polynomial
+    return np.append(np.repeat(lo, num) + np.repeat((hi - lo) / num, num) * j, xmax)
@@ -0,0 +1,302 @@
+"""
+Local HTTP service fitting and evaluating splines for other processes, without Qt nor matplotlib.
+
+It listens on localhost (or on a Unix socket with --unix) and speaks a minimal HTTP/1.1 with keep-alive:
+
+    POST /fit        {"x": [...], "y": [...], "degree": 5}          -> {"id": "...", "polynomials": n}
+    POST /fit        {"x": ..., "y": ..., "degree": 5, "samples": 1000}   -> values at evenly spaced points
+    POST /evaluate   {"id": "...", "t": [...]} or {"id": "...", "samples": 1000}   -> values
+    GET  /stats      counters of the requests, batches and the cache
+
+Values are streamed back as raw little-endian float64 in chunks (Transfer-Encoding: chunked), so large grids
+are evaluated and sent piece by piece, up to MAX_samples evenly spaced values. With "knots" (and optionally
+"smoothing") /fit makes a least-squares fit instead of interpolating, see 'least_squares_spline'.
+
+Fits on the same knots and degree arriving while a batch of them is solved (or within BATCH_window seconds)
+are solved together as one SoLE with several right-hand sides, and the factorizations are kept in a
+'SplineCache', so many clients fitting series sampled on the same x values share the work. Solving and
+evaluating run on a thread pool, numpy releases the GIL there, so the event loop keeps accepting requests.
+Example:
+
+    python3 spline_server.py --port 8765
+    curl -s localhost:8765/fit -d '{"x": [0, 1, 2, 3], "y": [0, 1, 0, 1], "samples": 5}' | od -t f8
+"""
+import sys
+import json
+import asyncio
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from spline_functions import SplineCache, PiecewisePolynomial, least_squares_spline, array_key
+
+DEGREES = range(3, 14, 2)      # the same degrees as on the slider in the GUI
+DEFAULT_host = "127.0.0.1"
+DEFAULT_port = 8765
+BATCH_window = 0.002            # seconds a fit waits for other fits on the same knots when none is solved
+MAX_batch = 256                 # a batch is solved right away once it has this many fits
+STREAM_chunk = 2**16            # number of values evaluated and sent at once
+MAX_body = 2**28                # max size of a request body in bytes
+MAX_samples = 2**30             # max number of evenly spaced values of a response, 8 GiB
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large"}
+
+
+class RequestError(Exception):
+    """Invalid request, answered with 'status' and the message."""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Batcher:
+    """
+    Collects the fits on the same knots and degree and solves them together with the factorization from the cache.
+    While a batch is solved, the next one collects the fits arriving meanwhile and is solved when it's done,
+    otherwise a batch is solved BATCH_window seconds after its first fit. A batch of MAX_batch fits is solved
+    right away.
+    """
+    def __init__(self, cache, executor, window=BATCH_window, max_batch=MAX_batch):
+        self.cache = cache
+        self.executor = executor
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = {}       # (knots key, degree) -> (x, list of (y, future))
+        self.running = {}       # (knots key, degree) -> number of batches being solved
+        self.batches = 0
+        self.fits = 0
+
+    async def fit(self, x, y, m):
+        """Returns the 'PiecewisePolynomial' through the points (x, y) of degree m, solved in a batch."""
+        loop = asyncio.get_running_loop()
+        key = (array_key(x), m)
+        if key not in self.pending:
+            self.pending[key] = (x, [])
+            if key not in self.running:     # otherwise it's solved when the running batch is done
+                loop.call_later(self.window, self.flush, key)
+        future = loop.create_future()
+        items = self.pending[key][1]
+        items.append((y, future))
+        if len(items) >= self.max_batch:
+            self.flush(key)
+        return await future
+
+    def flush(self, key):
+        """Solves the batch 'key' on the thread pool and resolves the futures of its fits."""
+        if key not in self.pending:     # already solved because it was full
+            return
+        x, items = self.pending.pop(key)
+        self.batches += 1
+        self.fits += len(items)
+        self.running[key] = self.running.get(key, 0) + 1
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(self.executor, self.solve, x, [y for y, _ in items], key[1])
+        task.add_done_callback(lambda task: self.done(key, task, items))
+
+    def done(self, key, task, items):
+        """Resolves the fits of a solved batch and solves the fits which arrived meanwhile."""
+        self.running[key] -= 1
+        if not self.running[key]:
+            del self.running[key]
+            self.flush(key)
+        self.resolve(task, items)
+
+    def solve(self, x, ys, m):
+        f = self.cache.system(x, m).fit(np.vstack(ys))
+        return [PiecewisePolynomial(f.x, c.copy()) for c in f.c]     # not views keeping the whole batch alive
+
+    @staticmethod
+    def resolve(task, items):
+        for k, (_, future) in enumerate(items):
+            if future.cancelled():  # the client has disconnected
+                continue
+            if task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result()[k])
+
+
+class SplineServer:
+    """Answers the requests of one connection after another, see the module docstring."""
+    def __init__(self, threads=None):
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="spline")
+        self.cache = SplineCache()
+        self.batcher = Batcher(self.cache, self.executor)
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        """Serves the requests of a connection until the client closes it."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_body:
+                    await self.send_json(writer, 413, {"error": "the request body is too large"})
+                    break
+                body = await reader.readexactly(length)
+                self.requests += 1
+                try:
+                    await self.dispatch(writer, method, path, body)
+                except RequestError as e:
+                    await self.send_json(writer, e.status, {"error": str(e)})
+                except MemoryError:
+                    await self.send_json(writer, 413, {"error": "not enough memory for the request"})
+                    break
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass    # the client disconnected or sent garbage, the connection is closed
+        finally:
+            writer.close()
+
+    async def dispatch(self, writer, method, path, body):
+        if method == "GET" and path == "/stats":
+            await self.send_json(writer, 200, self.stats())
+            return
+        if method != "POST" or path not in ("/fit", "/evaluate"):
+            raise RequestError(404, f"unknown request {method} {path}")
+        try:
+            request = json.loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise RequestError(400, f"invalid JSON: {e}")
+        if not isinstance(request, dict):
+            raise RequestError(400, "the request must be a JSON object")
+        if path == "/fit":
+            f = await self.fit(request)
+        else:
+            f = self.cache.get(("fitted", str(request.get("id"))))
+            if f is None:
+                raise RequestError(404, "unknown spline id, fit it again")
+        points = grid(f, request)
+        if points is None:
+            await self.send_json(writer, 200, {"id": self.remember(f), "polynomials": len(f)})
+        else:
+            await self.stream(writer, f, *points)
+
+    async def fit(self, request):
+        """Fits the spline of the /fit 'request', interpolating fits are batched."""
+        try:
+            x = np.asarray(request["x"], dtype=float)
+            y = np.asarray(request["y"], dtype=float)
+            m = request.get("degree", 3)
+        except (KeyError, TypeError, ValueError) as e:
+            raise RequestError(400, f"'x', 'y' and 'degree' must be numbers: {e}")
+        if x.ndim != 1 or x.shape != y.shape or len(x) < 2:
+            raise RequestError(400, "'x' and 'y' must be lists of the same length, at least 2")
+        if not (np.isfinite(x).all() and np.isfinite(y).all()):     # a NaN would spoil the whole batch
+            raise RequestError(400, "'x' and 'y' must be finite numbers")
+        if isinstance(m, bool) or not isinstance(m, (int, float)) or m not in DEGREES:    # 5.0 is fine, 5.5 isn't
+            raise RequestError(400, f"the degree must be one of {list(DEGREES)}")
+        m = int(m)
+        if "knots" in request:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self.executor, least_squares_spline, x, y, m,
+                                                  int(request["knots"]), float(request.get("smoothing", 0.0)))
+            except (TypeError, ValueError) as e:
+                raise RequestError(400, str(e))
+        if np.any(np.diff(x) <= 0):
+            raise RequestError(400, "'x' must be increasing")
+        try:
+            return await self.batcher.fit(x, y, m)
+        except np.linalg.LinAlgError as e:
+            raise RequestError(400, f"the spline can't be solved: {e}")
+
+    def remember(self, f):
+        """Keeps the spline 'f' in the cache and returns its id for /evaluate."""
+        key = array_key(np.concatenate([f.x, f.c.ravel()])).hex()
+        self.cache.put(("fitted", key), f)
+        return key
+
+    async def stream(self, writer, f, n, points):
+        """
+        Sends the values of f at the n points returned by points(start, stop) as little-endian float64 chunk by
+        chunk, so only one chunk of points and values is kept in memory.
+        """
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                     b"Transfer-Encoding: chunked\r\n\r\n")
+        loop = asyncio.get_running_loop()
+        for start in range(0, n, STREAM_chunk):
+            stop = min(start + STREAM_chunk, n)
+            try:
+                data = await loop.run_in_executor(self.executor,
+                                                  lambda: f(points(start, stop)).astype("<f8").tobytes())
+            except MemoryError as e:    # the status is sent already, the client sees the stream cut short
+                raise ConnectionAbortedError("out of memory while streaming") from e
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def send_json(self, writer, status, obj):
+        data = json.dumps(obj).encode()
+        writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s"
+                     % (status, REASONS[status].encode(), len(data), data))
+        await writer.drain()
+
+    def stats(self):
+        return {"requests": self.requests, "batches": self.batcher.batches, "batched_fits": self.batcher.fits,
+                "cache_hits": self.cache.hits, "cache_misses": self.cache.misses, "cache_bytes": self.cache.nbytes}
+
+
+def grid(f, request):
+    """
+    Returns the number n of points where the spline 'f' is evaluated for 'request' and the function returning
+    the points start to stop, None if it shouldn't be evaluated. Evenly spaced points are made chunk by chunk.
+    """
+    try:
+        if "t" in request:
+            t = np.asarray(request["t"], dtype=float).reshape(-1)
+            return len(t), lambda start, stop: t[start:stop]
+        if "samples" not in request:
+            return None
+        n = int(request["samples"])
+    except (TypeError, ValueError) as e:
+        raise RequestError(400, f"'t' must be numbers and 'samples' an integer: {e}")
+    if n < 0:
+        raise RequestError(400, "'samples' must not be negative")
+    if n > MAX_samples:
+        raise RequestError(413, f"at most {MAX_samples} samples are evaluated at once")
+    a, b = f.x[0], f.x[-1]
+    step = (b - a) / (n - 1) if n > 1 else 0.0
+    return n, lambda start, stop: np.minimum(a + step * np.arange(start, stop), b)
+
+
+async def serve(args):
+    server = SplineServer(args.threads)
+    if args.unix is not None:
+        listener = await asyncio.start_unix_server(server.handle, args.unix)
+        print(f"listening on {args.unix}", flush=True)
+    else:
+        listener = await asyncio.start_server(server.handle, args.host, args.port)
+        print(f"listening on http://{args.host}:{args.port}", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Serve spline fits and evaluations to local processes.")
+    parser.add_argument("--host", default=DEFAULT_host, help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_port, help="port to listen on")
+    parser.add_argument("--unix", help="listen on this Unix socket instead")
+    parser.add_argument("--threads", type=int, help="number of threads solving and evaluating the splines")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
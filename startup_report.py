@@ -0,0 +1,86 @@
+"""
+Reports how long it takes to import the modules of the project and checks that the computational core
+doesn't import the GUI libraries.
+
+Every module is imported in a fresh interpreter with `python -X importtime`. The report shows the total import
+time of each module and its slowest direct imports. The exit code is 1 if a core module imports matplotlib
+or PyQt5, or if it takes longer than the budget. Example:
+
+    python3 startup_report.py --budget 300
+"""
+import sys
+import argparse
+import subprocess
+
+CORE_modules = ["spline_functions", "point_store", "curve_tiles", "profiling", "spline_file", "spline_cli",
+                "benchmark", "spline_server", "load_generator"]
+GUI_modules = ["main"]
+GUI_packages = ("matplotlib", "PyQt5")   # the core must not import these
+DEFAULT_budget = 500    # ms per core module
+NUM_slowest = 5         # number of the slowest imports shown for every module
+
+CHECK_code = """
+import sys
+import {module}
+print(" ".join(sorted({{name.split(".")[0] for name in sys.modules}} & set({packages!r}))))
+"""
+
+
+def import_time(module):
+    """
+    Imports 'module' in a new interpreter. Returns (total, imports, gui) where 'total' is its import time in ms,
+    'imports' is a list of (ms, name) of the packages imported directly by it and 'gui' the GUI packages loaded.
+    """
+    code = CHECK_code.format(module=module, packages=GUI_packages)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    total, imports = 0, []
+    children = []
+    for line in result.stderr.splitlines():    # nested imports are printed before the module that imports them
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip())) // 2     # nested imports are indented by two spaces
+        ms = int(cumulative) / 1000
+        if depth == 1:
+            children.append((ms, name.strip()))
+        elif depth == 0 and name.strip() == module:
+            total, imports = ms, children
+        elif depth == 0:    # imported at the start of the interpreter
+            children = []
+    gui = result.stdout.split()
+    return total, imports, gui
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Report import times and check that the core is GUI-free.")
+    parser.add_argument("--budget", type=float, default=DEFAULT_budget,
+                        help="max import time of a core module in ms")
+    parser.add_argument("--gui", action="store_true", help="report the import time of the GUI too")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    failures = []
+    for module in CORE_modules + (GUI_modules if args.gui else []):
+        total, imports, gui = import_time(module)
+        slowest = ", ".join(f"{name} {ms:.0f} ms" for ms, name in sorted(imports, reverse=True)[:NUM_slowest])
+        print(f"{module:<18} {total:8.1f} ms   {slowest}")
+        if module in GUI_modules:
+            continue
+        if gui:
+            failures.append(f"{module} imports {', '.join(gui)}")
+        if total > args.budget:
+            failures.append(f"{module} takes {total:.0f} ms to import, the budget is {args.budget:.0f} ms")
+
+    for failure in failures:
+        print("FAILED:", failure)
+    if failures:
+        sys.exit(1)
+    print("OK: the core doesn't import", " nor ".join(GUI_packages))
+
+
+if __name__ == '__main__':
+    main()